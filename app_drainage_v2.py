@@ -7,12 +7,16 @@ UTM-based measurements, and complete drainage analysis
 
 import streamlit as st
 import folium
+from folium.elements import JSCSSMixin
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_folium import st_folium
 import geopandas as gpd
 import pandas as pd
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from jinja2 import Template
 
 st.set_page_config(
     page_title="UIT Dausa Drainage Master Plan v2",
@@ -20,33 +24,74 @@ st.set_page_config(
     layout="wide"
 )
 
+# GeoJSON reads go through pyogrio (batched Arrow reads, much faster than fiona)
+try:
+    import pyogrio  # noqa: F401
+except ImportError:
+    st.error("❌ pyogrio is required to read the map layers — run `pip install pyogrio`")
+    st.stop()
+
 # Setup paths
 BASE_DIR = Path(__file__).parent
 LAYERS_DIR = BASE_DIR / 'layers-v2'
 EXPORTS_DIR = BASE_DIR / 'exports-v2'
+STATIC_DIR = BASE_DIR / 'static'  # served at /app/static (enableStaticServing)
+FLOOD_PMTILES = STATIC_DIR / 'flood_risk.pmtiles'
+
+# Tooltip (column, alias) pairs per layer; columns missing from a file are skipped
+TOOLTIP_SCHEMA = {
+    'streams': [('stream_order', 'Order'), ('length_m_smoothed', 'Length (m)')],
+    'water_bodies': [('water_type', 'Type'), ('area_hectares', 'Area (ha)')],
+    'flood_risk': [('risk_label', 'Risk'), ('area_hectares', 'Area (ha)')],
+    'watersheds': [('watershed_id', 'Watershed'), ('area_km2', 'Area (km²)')],
+    'sar_flood': [('area_hectares', 'Area (ha)'), ('flood_intensity_db', 'Intensity (dB)')],
+    'hydrosheds': [('RIV_ORD', 'Order'), ('LENGTH_UTM_KM', 'Length (km)')],
+}
 
-@st.cache_data
+@st.cache_resource
 def load_layer(layer_name, projection='wgs84'):
-    """Load a layer file if it exists."""
+    """Load a layer file if it exists.
+
+    Loaders use st.cache_resource: every rerun gets the same live frame (and
+    its built spatial index) instead of an unpickled copy. Treat the result
+    as read-only -- copy or assign() before modifying.
+    """
     if projection == 'wgs84':
         layer_file = LAYERS_DIR / f'{layer_name}_wgs84.geojson'
     else:
         layer_file = LAYERS_DIR / f'{layer_name}_utm43n.geojson'
     
     if layer_file.exists():
-        return gpd.read_file(layer_file)
+        return gpd.read_file(layer_file, engine='pyogrio')
     return None
 
-@st.cache_data
+@st.cache_resource
 def load_boundaries():
     """Load UIT boundary polygons."""
     boundary_file = BASE_DIR / 'boundaries.geojson'
-    gdf = gpd.read_file(boundary_file)
+    gdf = gpd.read_file(boundary_file, engine='pyogrio')
     if gdf.crs != 'EPSG:4326':
         gdf = gdf.to_crs('EPSG:4326')
     return gdf
 
-@st.cache_data(ttl=300)
+@st.cache_resource
+def load_stream_layers():
+    """Load per-order stream layers as {order: GeoDataFrame}."""
+    stream_layers = {}
+    for order in [1, 2, 3, 4, 5]:
+        layer = load_layer(f'streams_order{order}')
+        if layer is not None and not layer.empty:
+            stream_layers[order] = layer
+
+    # Legacy: also try loading combined order3plus if per-order files don't exist
+    if not stream_layers:
+        legacy = load_layer('streams_order3plus')
+        if legacy is not None and not legacy.empty:
+            for order in legacy['stream_order'].unique():
+                stream_layers[int(order)] = legacy[legacy['stream_order'] == order].copy()
+    return stream_layers
+
+@st.cache_resource(ttl=300)
 def load_statistics():
     """Load per-polygon statistics (cache refreshes every 5 min)."""
     stats_file = EXPORTS_DIR / 'drainage_summary_full.csv'
@@ -77,8 +122,8 @@ if boundaries is None:
 st.sidebar.header("🎛️ Map Controls")
 
 # Polygon selector
-polygon_names = [f"Polygon {idx}: {row.get('name', 'Unnamed').strip()}" 
-                for idx, row in boundaries.iterrows()]
+names = boundaries['name'].str.strip() if 'name' in boundaries.columns else ['Unnamed'] * len(boundaries)
+polygon_names = [f"Polygon {idx}: {name}" for idx, name in zip(boundaries.index, names)]
 polygon_names.insert(0, "All Polygons")
 
 selected_polygon = st.sidebar.selectbox(
@@ -121,18 +166,7 @@ base_map = st.sidebar.selectbox(
 )
 
 # Load per-order stream layers
-stream_layers = {}
-for order in [1, 2, 3, 4, 5]:
-    layer = load_layer(f'streams_order{order}')
-    if layer is not None and not layer.empty:
-        stream_layers[order] = layer
-
-# Legacy: also try loading combined order3plus if per-order files don't exist
-if not stream_layers:
-    legacy = load_layer('streams_order3plus')
-    if legacy is not None and not legacy.empty:
-        for order in legacy['stream_order'].unique():
-            stream_layers[int(order)] = legacy[legacy['stream_order'] == order].copy()
+stream_layers = load_stream_layers()
 
 streams = None  # Replaced by stream_layers dict
 water_bodies = load_layer('water_bodies')
@@ -154,6 +188,45 @@ else:
 center_lat = (bounds[1] + bounds[3]) / 2
 center_lon = (bounds[0] + bounds[2]) / 2
 
+class PMTilesLayer(JSCSSMixin, folium.map.Layer):
+    """Polygon vector-tile layer read from a PMTiles archive (protomaps-leaflet).
+
+    Features are colored by `color_property` through `colors`; the browser
+    only fetches and parses the tiles currently in view.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = protomapsL.leafletLayer({
+                url: {{ this.url|tojson }},
+                paintRules: [{
+                    dataLayer: {{ this.data_layer|tojson }},
+                    symbolizer: new protomapsL.PolygonSymbolizer({
+                        fill: function(z, f) {
+                            var colors = {{ this.colors|tojson }};
+                            return colors[f.props[{{ this.color_property|tojson }}]] || {{ this.default_color|tojson }};
+                        },
+                        opacity: {{ this.opacity }}
+                    })
+                }],
+                labelRules: []
+            });
+        {% endmacro %}
+    """)
+    default_js = [
+        ('protomaps-leaflet', 'https://unpkg.com/protomaps-leaflet@4.0.1/dist/protomaps-leaflet.js')
+    ]
+
+    def __init__(self, url, data_layer, color_property, colors,
+                 default_color='#888', opacity=0.4, name=None):
+        super().__init__(name=name, overlay=True)
+        self._name = 'PMTilesLayer'
+        self.url = url
+        self.data_layer = data_layer
+        self.color_property = color_property
+        self.colors = colors
+        self.default_color = default_color
+        self.opacity = opacity
+
 # Create map
 tile_configs = {
     "Google Satellite": {
@@ -192,7 +265,12 @@ for name, config in tile_configs.items():
 
 # Filter layers to selected polygon if needed
 def filter_to_polygon(gdf, polygon_idx):
-    """Filter GeoDataFrame to intersect with selected polygon."""
+    """Filter GeoDataFrame to features touching the selected polygon.
+
+    Features are selected through the spatial index rather than clipped
+    with gpd.overlay -- the map only needs the touching features, not
+    the cut geometry.
+    """
     if gdf is None or gdf.empty:
         return gdf
     
@@ -205,20 +283,60 @@ def filter_to_polygon(gdf, polygon_idx):
         elif target_polygon.crs != 'EPSG:4326':
             target_polygon = target_polygon.to_crs(gdf.crs)
     
-    # Return intersection
-    try:
-        return gpd.overlay(gdf, target_polygon, how='intersection')
-    except:
-        return gdf  # Return original if intersection fails
+    # STRtree bbox lookup + exact intersects predicate
+    target_geom = target_polygon.geometry.iloc[0]
+    hits = gdf.sindex.query(target_geom, predicate='intersects')
+    hits.sort()  # keep original feature order
+    return gdf.iloc[hits]
+
+@st.cache_resource
+def get_filtered(layer_name, polygon_idx, stream_order=None):
+    """Filter a layer to one polygon, cached per (layer, polygon) pair.
+
+    Stream layers are addressed as layer_name='streams' plus stream_order.
+    Shared by reference like the loaders, so callers must not mutate it.
+    """
+    if layer_name == 'streams':
+        gdf = load_stream_layers().get(stream_order)
+    else:
+        gdf = load_layer(layer_name)
+    return filter_to_polygon(gdf, polygon_idx)
+
+@st.cache_data
+def as_geojson(_gdf, cache_key, simplify_tolerance=None):
+    """Serialize a GeoDataFrame to a GeoJSON dict, once per cache_key.
+
+    The frame itself is not hashed (leading underscore); cache_key must
+    identify its contents, e.g. (layer_name, selected_polygon). With a
+    simplify_tolerance (degrees) geometries are Douglas-Peucker simplified
+    first -- display only, exports keep full resolution.
+    """
+    if simplify_tolerance:
+        _gdf = _gdf.assign(geometry=_gdf.geometry.simplify(simplify_tolerance, preserve_topology=True))
+    return json.loads(_gdf.to_json())
+
+def build_tooltip(gdf, layer_name, **kwargs):
+    """GeoJsonTooltip for the TOOLTIP_SCHEMA columns present in gdf, or None."""
+    pairs = [(c, a) for c, a in TOOLTIP_SCHEMA[layer_name] if c in gdf.columns]
+    if not pairs:
+        return None
+    return folium.GeoJsonTooltip(fields=[c for c, _ in pairs], aliases=[a for _, a in pairs], **kwargs)
 
 if selected_polygon > 0:  # Single polygon selected
     polygon_idx = selected_polygon - 1
-    streams_filtered = {o: filter_to_polygon(gdf, polygon_idx) for o, gdf in stream_layers.items()}
-    water_filtered = filter_to_polygon(water_bodies, polygon_idx)
-    flood_risk_filtered = filter_to_polygon(flood_risk, polygon_idx)
-    watersheds_filtered = filter_to_polygon(watersheds, polygon_idx)
-    sar_flood_filtered = filter_to_polygon(sar_flood, polygon_idx)
-    hydrosheds_filtered = filter_to_polygon(hydrosheds, polygon_idx)
+    # Layers are independent and GEOS releases the GIL, so filter them on threads
+    filter_jobs = [('streams', o) for o in stream_layers] + [
+        (name, None) for name in ['water_bodies', 'flood_risk', 'watersheds', 'sar_flood', 'hydrosheds']]
+    # Worker threads need the script context to use the st.cache_* functions
+    with ThreadPoolExecutor(max_workers=6, initializer=add_script_run_ctx,
+                            initargs=(None, get_script_run_ctx())) as ex:
+        filtered = dict(zip(filter_jobs, ex.map(lambda job: get_filtered(job[0], polygon_idx, job[1]), filter_jobs)))
+    streams_filtered = {o: filtered[('streams', o)] for o in stream_layers}
+    water_filtered = filtered[('water_bodies', None)]
+    flood_risk_filtered = filtered[('flood_risk', None)]
+    watersheds_filtered = filtered[('watersheds', None)]
+    sar_flood_filtered = filtered[('sar_flood', None)]
+    hydrosheds_filtered = filtered[('hydrosheds', None)]
 else:  # All polygons
     streams_filtered = stream_layers
     water_filtered = water_bodies
@@ -227,36 +345,42 @@ else:  # All polygons
     sar_flood_filtered = sar_flood
     hydrosheds_filtered = hydrosheds
 
+# Non-empty flags, resolved once per rerun
+has_streams = {o: gdf is not None and len(gdf) > 0 for o, gdf in streams_filtered.items()}
+has = {name: gdf is not None and len(gdf) > 0 for name, gdf in [
+    ('water_bodies', water_filtered),
+    ('flood_risk', flood_risk_filtered),
+    ('watersheds', watersheds_filtered),
+    ('sar_flood', sar_flood_filtered),
+    ('hydrosheds', hydrosheds_filtered),
+]}
+
 # Add UIT boundaries
 if show_boundaries:
     if selected_polygon > 0:
-        # Highlight selected polygon
-        selected_boundary = boundaries.iloc[[selected_polygon - 1]]
+        # Highlight selected polygon via a per-feature flag -- one layer, no drop/copy
+        selected_style = {
+            'fillColor': 'yellow',
+            'color': '#ff0000',
+            'weight': 4,
+            'dashArray': '5,5',
+            'fillOpacity': 0.1
+        }
+        other_style = {
+            'fillColor': 'none',
+            'color': '#cc0000',
+            'weight': 2,
+            'opacity': 0.5,
+            'dashArray': '10,5'
+        }
+        boundaries_display = boundaries.assign(
+            _is_selected=boundaries.index == boundaries.index[selected_polygon - 1]
+        )
         folium.GeoJson(
-            selected_boundary,
-            style_function=lambda x: {
-                'fillColor': 'yellow',
-                'color': '#ff0000',
-                'weight': 4,
-                'dashArray': '5,5',
-                'fillOpacity': 0.1
-            },
+            boundaries_display,
+            style_function=lambda x: selected_style if x['properties']['_is_selected'] else other_style,
             tooltip=folium.GeoJsonTooltip(['name', 'layer']),
-            name='Selected UIT Polygon'
-        ).add_to(m)
-        
-        # Add other boundaries in lighter style
-        other_boundaries = boundaries.drop(boundaries.index[selected_polygon - 1])
-        folium.GeoJson(
-            other_boundaries,
-            style_function=lambda x: {
-                'fillColor': 'none',
-                'color': '#cc0000', 
-                'weight': 2,
-                'opacity': 0.5,
-                'dashArray': '10,5'
-            },
-            name='Other UIT Polygons'
+            name='UIT Polygons (selected highlighted)'
         ).add_to(m)
     else:
         # All boundaries
@@ -278,26 +402,23 @@ stream_weights = {1: 1, 2: 1.5, 3: 2, 4: 3, 5: 4}
 stream_opacities = {1: 0.5, 2: 0.6, 3: 0.8, 4: 0.9, 5: 1.0}
 
 for order in sorted(selected_stream_orders):
-    order_gdf = streams_filtered.get(order)
-    if order_gdf is not None and not order_gdf.empty:
+    if has_streams.get(order, False):
+        order_gdf = streams_filtered[order]
         color = stream_colors.get(order, '#4169E1')
         weight = stream_weights.get(order, 2)
         opacity = stream_opacities.get(order, 0.8)
 
-        tooltip_fields = [c for c in ['stream_order', 'length_m_smoothed'] if c in order_gdf.columns]
-        tooltip_aliases = [a for c, a in [('stream_order', 'Order'), ('length_m_smoothed', 'Length (m)')] if c in order_gdf.columns]
-
         folium.GeoJson(
-            order_gdf,
+            as_geojson(order_gdf, ('streams', selected_polygon, order)),
             style_function=lambda x, c=color, w=weight, o=opacity: {
                 'color': c, 'weight': w, 'opacity': o
             },
-            tooltip=folium.GeoJsonTooltip(fields=tooltip_fields, aliases=tooltip_aliases) if tooltip_fields else None,
+            tooltip=build_tooltip(order_gdf, 'streams'),
             name=f'Order {order} ({len(order_gdf)})'
         ).add_to(m)
 
 # Add water bodies
-if show_water and water_filtered is not None and not water_filtered.empty:
+if show_water and has['water_bodies']:
     water_colors = {
         'permanent_jrc': '#0000FF',
         'seasonal_jrc': '#4682B4',
@@ -305,27 +426,42 @@ if show_water and water_filtered is not None and not water_filtered.empty:
         'pre_monsoon_s2': '#87CEEB'
     }
 
-    tooltip_fields = [c for c in ['water_type', 'area_hectares'] if c in water_filtered.columns]
-    tooltip_aliases = [a for c, a in [('water_type', 'Type'), ('area_hectares', 'Area (ha)')] if c in water_filtered.columns]
+    # Resolve colors once per layer instead of once per feature in style_function
+    water_display = water_filtered.assign(
+        _color=water_filtered['water_type'].map(water_colors).fillna('#00CED1')
+    )
 
     folium.GeoJson(
-        water_filtered,
+        as_geojson(water_display, ('water_bodies', selected_polygon)),
         style_function=lambda x: {
-            'fillColor': water_colors.get(x['properties'].get('water_type', ''), '#00CED1'),
-            'color': water_colors.get(x['properties'].get('water_type', ''), '#00CED1'),
+            'fillColor': x['properties']['_color'],
+            'color': x['properties']['_color'],
             'weight': 1,
             'fillOpacity': 0.7
         },
-        tooltip=folium.GeoJsonTooltip(fields=tooltip_fields, aliases=tooltip_aliases) if tooltip_fields else None,
+        tooltip=build_tooltip(water_filtered, 'water_bodies'),
         name=f'Water Bodies ({len(water_filtered)})'
     ).add_to(m)
 
-# Add flood risk zones — cap to largest polygons to avoid browser overload
-if show_flood_risk and flood_risk_filtered is not None and not flood_risk_filtered.empty:
-    risk_colors = {'high': '#FF0000', 'medium': '#FFA500', 'low': '#FFFF00'}
-
+# Add flood risk zones — vector tiles when baked by flood_risk_v2.py,
+# otherwise GeoJSON capped to the largest polygons to avoid browser overload
+risk_colors = {'high': '#FF0000', 'medium': '#FFA500', 'low': '#FFFF00'}
+
+if show_flood_risk and FLOOD_PMTILES.exists() and selected_polygon == 0:
+    # Tiles hold the full layer; only the tiles in view are fetched, so no cap.
+    # They cannot be clipped to one polygon, so a single-polygon view falls
+    # through to the filtered GeoJSON below
+    PMTilesLayer(
+        '/app/static/flood_risk.pmtiles',
+        data_layer='flood_risk',
+        color_property='risk_label',
+        colors=risk_colors,
+        name='Flood Risk (vector tiles)'
+    ).add_to(m)
+elif show_flood_risk and has['flood_risk']:
     # Limit to top 2000 polygons by area to keep browser responsive
     MAX_FLOOD_FEATURES = 2000
+    FLOOD_SIMPLIFY_DEG = 2e-4  # ~20 m, under one 30 m DEM pixel
     if len(flood_risk_filtered) > MAX_FLOOD_FEATURES:
         flood_display = flood_risk_filtered.nlargest(MAX_FLOOD_FEATURES, 'area_hectares')
         flood_label = f'Flood Risk (top {MAX_FLOOD_FEATURES}/{len(flood_risk_filtered)})'
@@ -333,81 +469,72 @@ if show_flood_risk and flood_risk_filtered is not None and not flood_risk_filter
         flood_display = flood_risk_filtered
         flood_label = f'Flood Risk ({len(flood_risk_filtered)})'
 
-    tooltip_fields = [c for c in ['risk_label', 'area_hectares'] if c in flood_display.columns]
-    tooltip_aliases = [a for c, a in [('risk_label', 'Risk'), ('area_hectares', 'Area (ha)')] if c in flood_display.columns]
+    # Resolve colors once per layer instead of once per feature in style_function
+    flood_display = flood_display.assign(
+        _color=flood_display['risk_label'].map(risk_colors).fillna('#888')
+    )
 
     folium.GeoJson(
-        flood_display,
+        as_geojson(flood_display, ('flood_risk', selected_polygon), FLOOD_SIMPLIFY_DEG),
         style_function=lambda x: {
-            'fillColor': risk_colors.get(x['properties'].get('risk_label', ''), '#888'),
-            'color': risk_colors.get(x['properties'].get('risk_label', ''), '#888'),
+            'fillColor': x['properties']['_color'],
+            'color': x['properties']['_color'],
             'weight': 0.5,
             'fillOpacity': 0.4
         },
-        tooltip=folium.GeoJsonTooltip(fields=tooltip_fields, aliases=tooltip_aliases) if tooltip_fields else None,
+        tooltip=build_tooltip(flood_display, 'flood_risk'),
         name=flood_label
     ).add_to(m)
 
 # Add watersheds
-if show_watersheds and watersheds_filtered is not None and not watersheds_filtered.empty:
+if show_watersheds and has['watersheds']:
     import random
     random.seed(42)
     palette = [f'#{random.randint(50,220):02x}{random.randint(50,220):02x}{random.randint(50,220):02x}' for _ in range(20)]
 
+    WATERSHED_SIMPLIFY_DEG = 3e-4  # ~30 m, basins are only shown as context
+
     # Add a color column for styling
     ws_display = watersheds_filtered.copy()
     ws_display['_color'] = [palette[i % len(palette)] for i in range(len(ws_display))]
 
-    tooltip_fields = [c for c in ['watershed_id', 'area_km2'] if c in ws_display.columns]
-    tooltip_aliases = [a for c, a in [('watershed_id', 'Watershed'), ('area_km2', 'Area (km²)')] if c in ws_display.columns]
-
     folium.GeoJson(
-        ws_display,
+        as_geojson(ws_display, ('watersheds', selected_polygon), WATERSHED_SIMPLIFY_DEG),
         style_function=lambda x: {
             'fillColor': x['properties'].get('_color', '#888'),
             'color': '#333',
             'weight': 0.5,
             'fillOpacity': 0.2
         },
-        tooltip=folium.GeoJsonTooltip(fields=tooltip_fields, aliases=tooltip_aliases) if tooltip_fields else None,
+        tooltip=build_tooltip(ws_display, 'watersheds'),
         name=f'Watersheds ({len(ws_display)})'
     ).add_to(m)
 
 # Add SAR flood areas
-if show_sar_flood and sar_flood_filtered is not None and not sar_flood_filtered.empty:
-    fg_sar = folium.FeatureGroup(name=f'SAR Flood History ({len(sar_flood_filtered)})')
-    
-    for idx, sar in sar_flood_filtered.iterrows():
-        area_ha = sar.get('area_hectares', 0)
-        intensity = sar.get('flood_intensity_db', 0)
-        
-        folium.GeoJson(
-            sar.geometry,
-            style_function=lambda x: {
-                'fillColor': '#800080',
-                'color': '#800080',
-                'weight': 1,
-                'fillOpacity': 0.5
-            },
-            tooltip=f"SAR Flood Area<br>Area: {area_ha:.1f} ha<br>Intensity: {intensity:.1f} dB"
-        ).add_to(fg_sar)
-    
-    fg_sar.add_to(m)
+if show_sar_flood and has['sar_flood']:
+    folium.GeoJson(
+        as_geojson(sar_flood_filtered, ('sar_flood', selected_polygon)),
+        style_function=lambda x: {
+            'fillColor': '#800080',
+            'color': '#800080',
+            'weight': 1,
+            'fillOpacity': 0.5
+        },
+        tooltip=build_tooltip(sar_flood_filtered, 'sar_flood', localize=True),
+        name=f'SAR Flood History ({len(sar_flood_filtered)})'
+    ).add_to(m)
 
 # Add HydroSHEDS reference
-if show_hydrosheds and hydrosheds_filtered is not None and not hydrosheds_filtered.empty:
-    tooltip_fields = [c for c in ['RIV_ORD', 'LENGTH_UTM_KM'] if c in hydrosheds_filtered.columns]
-    tooltip_aliases = [a for c, a in [('RIV_ORD', 'Order'), ('LENGTH_UTM_KM', 'Length (km)')] if c in hydrosheds_filtered.columns]
-
+if show_hydrosheds and has['hydrosheds']:
     folium.GeoJson(
-        hydrosheds_filtered,
+        as_geojson(hydrosheds_filtered, ('hydrosheds', selected_polygon)),
         style_function=lambda x: {
             'color': '#00FF00',
             'weight': 3,
             'opacity': 0.7,
             'dashArray': '8,4'
         },
-        tooltip=folium.GeoJsonTooltip(fields=tooltip_fields, aliases=tooltip_aliases) if tooltip_fields else None,
+        tooltip=build_tooltip(hydrosheds_filtered, 'hydrosheds'),
         name=f'HydroSHEDS Reference ({len(hydrosheds_filtered)})'
     ).add_to(m)
 
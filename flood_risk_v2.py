@@ -6,11 +6,16 @@ composite flood risk map for all 11 UIT polygons
 """
 
 import os
+import math
+import shutil
+import subprocess
 import numpy as np
 import rasterio
 import geopandas as gpd
+import shapely
 from rasterio.features import shapes
 from shapely.geometry import shape, Polygon
+from numba import njit, prange
 
 print("\n" + "="*70)
 print("FLOOD RISK ANALYSIS v2 (Full Scale)")
@@ -20,6 +25,7 @@ print("="*70)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data-v2')
 LAYERS_DIR = os.path.join(BASE_DIR, 'layers-v2')
+STATIC_DIR = os.path.join(BASE_DIR, 'static')  # served by Streamlit at /app/static
 
 # Required input files
 TWI_FILE = os.path.join(DATA_DIR, 'twi_utm43n.tif')
@@ -45,13 +51,13 @@ print("✓ All required files found")
 print("\n1. Loading TWI and DEM data...")
 
 with rasterio.open(TWI_FILE) as twi_src:
-    twi = twi_src.read(1)
+    twi = twi_src.read(1, out_dtype=np.float32)
     twi_transform = twi_src.transform
     twi_crs = twi_src.crs
     twi_bounds = twi_src.bounds
 
 with rasterio.open(DEM_FILE) as dem_src:
-    dem = dem_src.read(1)
+    dem = dem_src.read(1, out_dtype=np.float32)
     dem_transform = dem_src.transform
 
 print(f"✓ TWI loaded: {twi.shape} pixels")
@@ -60,13 +66,48 @@ print(f"  TWI range: {np.nanmin(twi):.1f} to {np.nanmax(twi):.1f}")
 print(f"✓ DEM loaded: {dem.shape} pixels")
 print(f"  Elevation range: {np.nanmin(dem):.1f} to {np.nanmax(dem):.1f} m")
 
-# 2. CALCULATE SLOPE
-print("\n2. Calculating slope...")
-
-# Calculate slope using numpy gradients
-dy, dx = np.gradient(dem, 30, 30)  # 30m pixel size
-slope = np.arctan(np.sqrt(dx**2 + dy**2))
-slope_degrees = np.rad2deg(slope)
+# 2. CALCULATE SLOPE AND PONDING ZONES
+print("\n2. Calculating slope and ponding zones...")
+
+# Low-lying areas (bottom 10% of elevation). This is the only global
+# statistic the topographic stage needs, so it is taken up front and the
+# slope -> low/flat -> ponding chain then runs as one fused pass.
+elevation_threshold = np.nanpercentile(dem, 10)
+
+@njit(parallel=True, cache=True)
+def topography_kernel(dem, px, low_threshold):
+    """Slope (degrees) and ponding mask from a single pass over the DEM.
+
+    Slope matches np.gradient (central differences inside, one-sided at
+    the edges) followed by arctan/rad2deg; NaN cells propagate to their
+    neighbours as before. A cell is a ponding zone when it is low-lying
+    (elevation <= low_threshold) and very flat (slope < 1 degree). The
+    low/flat masks only live in registers; their cell counts are returned.
+    """
+    H, W = dem.shape
+    slope = np.empty_like(dem)
+    ponding = np.empty((H, W), dtype=np.bool_)
+    n_low = 0
+    n_flat = 0
+    for i in prange(H):
+        i0 = max(i - 1, 0)
+        i1 = min(i + 1, H - 1)
+        for j in range(W):
+            j0 = max(j - 1, 0)
+            j1 = min(j + 1, W - 1)
+            dx = (dem[i, j1] - dem[i, j0]) / ((j1 - j0) * px)
+            dy = (dem[i1, j] - dem[i0, j]) / ((i1 - i0) * px)
+            s = math.degrees(math.atan(math.sqrt(dx * dx + dy * dy)))
+            slope[i, j] = s
+            low = dem[i, j] <= low_threshold
+            flat = s < 1.0
+            n_low += low
+            n_flat += flat
+            ponding[i, j] = low and flat
+    return slope, ponding, n_low, n_flat
+
+# 30m pixel size
+slope_degrees, ponding_zones, n_low, n_flat = topography_kernel(dem, 30.0, elevation_threshold)
 
 print(f"✓ Slope calculated")
 print(f"  Slope range: {np.nanmin(slope_degrees):.1f}° to {np.nanmax(slope_degrees):.1f}°")
@@ -74,40 +115,47 @@ print(f"  Slope range: {np.nanmin(slope_degrees):.1f}° to {np.nanmax(slope_degr
 # 3. IDENTIFY DEPRESSIONS AND LOW-LYING AREAS
 print("\n3. Identifying depressions and low-lying areas...")
 
-# Low-lying areas (bottom 10% of elevation)
-elevation_threshold = np.nanpercentile(dem[~np.isnan(dem)], 10)
-low_areas = dem <= elevation_threshold
-
-# Very flat areas (slope < 1 degree)
-flat_areas = slope_degrees < 1.0
-
 # Potential ponding zones (combination of low elevation and flat slope)
-ponding_zones = low_areas & flat_areas
-
+# were marked by topography_kernel above
 print(f"✓ Topographic analysis complete")
 print(f"  Low elevation threshold: {elevation_threshold:.1f} m")
-print(f"  Low-lying area: {np.sum(low_areas) * 0.0009:.1f} km²")
-print(f"  Flat areas (<1°): {np.sum(flat_areas) * 0.0009:.1f} km²")
+print(f"  Low-lying area: {n_low * 0.0009:.1f} km²")
+print(f"  Flat areas (<1°): {n_flat * 0.0009:.1f} km²")
 print(f"  Ponding zones: {np.sum(ponding_zones) * 0.0009:.1f} km²")
 
 # 4. TWI-BASED WETNESS CLASSIFICATION
 print("\n4. TWI-based wetness classification...")
 
-# Remove infinite and NaN values from TWI
-twi_clean = twi.copy()
-twi_clean[~np.isfinite(twi_clean)] = np.nan
+# Remove infinite and NaN values from TWI (in place, no full copy)
+twi[~np.isfinite(twi)] = np.nan
+twi_clean = twi
 
-# Define TWI thresholds based on distribution
-valid_twi = twi_clean[~np.isnan(twi_clean)]
-twi_low = np.percentile(valid_twi, 75)    # Top 25% = wet areas
-twi_high = np.percentile(valid_twi, 90)   # Top 10% = very wet areas
+# Define TWI thresholds based on distribution (NaNs skipped in place)
+# Top 25% = wet areas, top 10% = very wet areas (one selection pass)
+twi_low, twi_high = np.nanpercentile(twi_clean, [75, 90])
 
 print(f"TWI thresholds: Low={twi_low:.1f}, High={twi_high:.1f}")
 
-# Create TWI risk zones
-twi_risk = np.zeros_like(twi_clean, dtype=np.int8)
-twi_risk[twi_clean >= twi_low] = 1   # Medium risk
-twi_risk[twi_clean >= twi_high] = 2  # High risk
+@njit(parallel=True, cache=True)
+def classify_kernel(values, low, high):
+    """Classify in one pass: 0 below low, 1 from low, 2 from high, -1 for NaN."""
+    H, W = values.shape
+    out = np.empty((H, W), dtype=np.int8)
+    for i in prange(H):
+        for j in range(W):
+            v = values[i, j]
+            if np.isnan(v):
+                out[i, j] = -1
+            elif v >= high:
+                out[i, j] = 2
+            elif v >= low:
+                out[i, j] = 1
+            else:
+                out[i, j] = 0
+    return out
+
+# Create TWI risk zones (-1 = no data)
+twi_risk = classify_kernel(twi_clean, twi_low, twi_high)
 
 print(f"✓ TWI risk zones created:")
 print(f"  Low risk: {np.sum(twi_risk == 0) * 0.0009:.1f} km²")
@@ -118,11 +166,11 @@ print(f"  High risk: {np.sum(twi_risk == 2) * 0.0009:.1f} km²")
 print("\n5. Loading SAR flood data...")
 
 sar_flood_file = os.path.join(LAYERS_DIR, 'sar_flood_full_utm43n.geojson')
-sar_risk_raster = np.zeros_like(twi, dtype=np.float32)
+sar_risk_raster = np.zeros(twi.shape, dtype=np.uint8)  # 0/1 flood mask
 
 if os.path.exists(sar_flood_file):
     try:
-        sar_floods = gpd.read_file(sar_flood_file)
+        sar_floods = gpd.read_file(sar_flood_file, engine='pyogrio')
         
         if not sar_floods.empty:
             print(f"✓ SAR flood data loaded: {len(sar_floods)} flood areas")
@@ -130,13 +178,15 @@ if os.path.exists(sar_flood_file):
             # Rasterize SAR flood areas
             from rasterio.features import rasterize
             
-            flood_shapes = [(geom, 1.0) for geom in sar_floods.geometry]
+            # Burn every polygon as 1 straight from the geometry array
             sar_risk_raster = rasterize(
-                flood_shapes,
+                sar_floods.geometry.values,
                 out_shape=twi.shape,
                 transform=twi_transform,
-                fill=0.0,
-                dtype=np.float32
+                fill=0,
+                default_value=1,
+                all_touched=False,
+                dtype=np.uint8
             )
             
             print(f"  SAR flood area: {np.sum(sar_risk_raster > 0) * 0.0009:.1f} km²")
@@ -153,55 +203,62 @@ else:
 print("\n6. Creating composite flood risk map...")
 
 # Normalize all risk factors to 0-1 scale
-def normalize_raster(raster):
-    """Normalize raster to 0-1 scale."""
-    valid_data = raster[~np.isnan(raster) & np.isfinite(raster)]
+def normalize_params(raster):
+    """Return (min, 1/range) for 0-1 scaling; scale is 0 for flat or empty rasters."""
+    valid_data = raster[np.isfinite(raster)]
     if len(valid_data) == 0:
-        return np.zeros_like(raster)
+        return 0.0, 0.0
     
     min_val, max_val = np.min(valid_data), np.max(valid_data)
     if max_val == min_val:
-        return np.zeros_like(raster)
+        return float(min_val), 0.0
     
-    normalized = (raster - min_val) / (max_val - min_val)
-    normalized = np.clip(normalized, 0, 1)
-    return normalized
-
-# Normalize individual risk factors
-twi_norm = normalize_raster(twi_clean)
-ponding_norm = ponding_zones.astype(np.float32)
-sar_norm = normalize_raster(sar_risk_raster)
+    return float(min_val), 1.0 / (max_val - min_val)
+
+@njit(parallel=True, cache=True)
+def composite_risk_kernel(twi, twi_min, twi_scale, ponding, sar, sar_min, sar_scale, weights):
+    """Normalize, weight and NaN-mask all risk factors in a single pass."""
+    H, W = twi.shape
+    out = np.empty((H, W), dtype=np.float32)
+    for i in prange(H):
+        for j in range(W):
+            t = twi[i, j]
+            if not np.isfinite(t):
+                out[i, j] = np.nan
+                continue
+            t_norm = min(max((t - twi_min) * twi_scale, 0.0), 1.0)
+            s_norm = min(max((sar[i, j] - sar_min) * sar_scale, 0.0), 1.0)
+            out[i, j] = (weights[0] * t_norm +
+                         weights[1] * ponding[i, j] +
+                         weights[2] * s_norm)
+    return out
 
 # Weighted composite risk
 # Weights: TWI (40%), Ponding zones (30%), SAR history (30%)
 weights = [0.4, 0.3, 0.3]
 
-composite_risk = (
-    weights[0] * twi_norm +
-    weights[1] * ponding_norm +
-    weights[2] * sar_norm
-)
+twi_min, twi_scale = normalize_params(twi_clean)
+sar_min, sar_scale = normalize_params(sar_risk_raster)
 
-# Set invalid areas to NaN
-composite_risk[np.isnan(twi)] = np.nan
+# Invalid (non-finite TWI) areas come out as NaN
+composite_risk = composite_risk_kernel(
+    twi_clean, twi_min, twi_scale,
+    ponding_zones,
+    sar_risk_raster, sar_min, sar_scale,
+    np.array(weights, dtype=np.float32)
+)
 
 print(f"✓ Composite risk calculated with weights: TWI({weights[0]:.0%}), Ponding({weights[1]:.0%}), SAR({weights[2]:.0%})")
 
 # 7. CLASSIFY COMPOSITE RISK
 print("\n7. Classifying flood risk levels...")
 
-# Define risk level thresholds
-valid_risk = composite_risk[~np.isnan(composite_risk)]
-risk_low = np.percentile(valid_risk, 70)    # Bottom 70% = low risk
-risk_medium = np.percentile(valid_risk, 85) # 70-85% = medium risk
-                                           # Top 15% = high risk
-
-flood_risk_classified = np.zeros_like(composite_risk, dtype=np.int8)
-flood_risk_classified[composite_risk >= risk_low] = 1      # Medium risk
-flood_risk_classified[composite_risk >= risk_medium] = 2   # High risk
+# Define risk level thresholds (NaNs skipped in place)
+# Bottom 70% = low risk, 70-85% = medium risk, top 15% = high risk
+risk_low, risk_medium = np.nanpercentile(composite_risk, [70, 85])
 
-# Set NaN areas to -1
-flood_risk_classified[np.isnan(composite_risk)] = -1
+# 1 = medium, 2 = high, NaN areas = -1
+flood_risk_classified = classify_kernel(composite_risk, risk_low, risk_medium)
 
 print(f"Risk thresholds: Low={risk_low:.2f}, Medium={risk_medium:.2f}")
 
@@ -218,37 +275,34 @@ for level, area in risk_areas.items():
 # 8. VECTORIZE RISK ZONES
 print("\n8. Vectorizing flood risk zones...")
 
-risk_polygons = []
-
-for risk_level in [2, 1]:  # High, Medium only (skip low to avoid massive polygon count)
-    mask = (flood_risk_classified == risk_level)
-    
-    if np.sum(mask) > 0:
-        # Convert raster to polygons
-        polygon_shapes = shapes(mask.astype(np.uint8), mask=mask, transform=twi_transform)
-        
-        for geom, value in polygon_shapes:
-            if value == 1:  # Only include risk areas
-                polygon = shape(geom)
-                
-                # Filter out very small polygons (< 0.1 hectare)
-                if polygon.area > 1000:  # 1000 m² = 0.1 hectare
-                    
-                    risk_label = {2: 'high', 1: 'medium', 0: 'low'}[risk_level]
-                    
-                    risk_polygons.append({
-                        'geometry': polygon,
-                        'risk_level': risk_level,
-                        'risk_label': risk_label,
-                        'area_m2': polygon.area,
-                        'area_hectares': polygon.area / 10000,
-                        'twi_contribution': weights[0],
-                        'ponding_contribution': weights[1],
-                        'sar_contribution': weights[2]
-                    })
-
-if risk_polygons:
-    flood_risk_gdf = gpd.GeoDataFrame(risk_polygons, crs=twi_crs)
+# High and Medium only (skip low to avoid massive polygon count). A single
+# polygonize pass over the classified raster yields both levels; zones of
+# different levels are never merged because shapes() splits on value.
+risk_mask = flood_risk_classified >= 1
+risk_shapes = list(shapes(flood_risk_classified, mask=risk_mask, transform=twi_transform))
+
+# Areas for every polygon in one vectorized shapely call
+polygons = np.array([shape(geom) for geom, _ in risk_shapes], dtype=object)
+risk_levels = np.array([int(value) for _, value in risk_shapes], dtype=np.int64)
+areas = shapely.area(polygons)
+
+# Filter out very small polygons (< 0.1 hectare)
+keep = areas > 1000  # 1000 m² = 0.1 hectare
+
+if keep.any():
+    risk_labels = np.array(['low', 'medium', 'high'])
+    flood_risk_gdf = gpd.GeoDataFrame({
+        'risk_level': risk_levels[keep],
+        'risk_label': risk_labels[risk_levels[keep]],
+        'area_m2': areas[keep],
+        'area_hectares': areas[keep] / 10000,
+        'twi_contribution': weights[0],
+        'ponding_contribution': weights[1],
+        'sar_contribution': weights[2]
+    }, geometry=polygons[keep], crs=twi_crs)
+
+    # Keep high-risk zones first, as in the former per-level output (stable sort)
+    flood_risk_gdf = flood_risk_gdf.sort_values('risk_level', ascending=False, kind='stable', ignore_index=True)
     
     print(f"✓ {len(flood_risk_gdf)} flood risk polygons created")
     
@@ -264,16 +318,30 @@ if risk_polygons:
     
     # Save in UTM 43N
     flood_risk_utm_path = os.path.join(LAYERS_DIR, 'flood_risk_utm43n.geojson')
-    flood_risk_gdf.to_file(flood_risk_utm_path, driver='GeoJSON')
+    flood_risk_gdf.to_file(flood_risk_utm_path, driver='GeoJSON', engine='pyogrio')
     
     # Save in WGS84 for web display
     flood_risk_wgs84 = flood_risk_gdf.to_crs('EPSG:4326')
     flood_risk_wgs84_path = os.path.join(LAYERS_DIR, 'flood_risk_wgs84.geojson')
-    flood_risk_wgs84.to_file(flood_risk_wgs84_path, driver='GeoJSON')
+    flood_risk_wgs84.to_file(flood_risk_wgs84_path, driver='GeoJSON', engine='pyogrio')
     
     print(f"✓ UTM flood risk saved: {flood_risk_utm_path}")
     print(f"✓ WGS84 flood risk saved: {flood_risk_wgs84_path}")
     
+    # Bake vector tiles for the dashboard so the browser only parses the
+    # tiles in view (optional: needs tippecanoe >= 2.17 on PATH)
+    if shutil.which('tippecanoe'):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        flood_risk_pmtiles_path = os.path.join(STATIC_DIR, 'flood_risk.pmtiles')
+        subprocess.run([
+            'tippecanoe', '-o', flood_risk_pmtiles_path, '--force',
+            '--layer=flood_risk', '-zg', '--drop-densest-as-needed',
+            flood_risk_wgs84_path
+        ], check=True)
+        print(f"✓ Vector tiles saved: {flood_risk_pmtiles_path}")
+    else:
+        print("⚠ tippecanoe not found, skipping PMTiles (dashboard falls back to GeoJSON)")
+    
 else:
     print("⚠ No significant flood risk areas found")
 
@@ -292,7 +360,15 @@ with rasterio.open(
     dtype=composite_risk.dtype,
     crs=twi_crs,
     transform=twi_transform,
-    compress='lzw'
+    # Floating-point predictor + ZSTD packs float32 far better than LZW;
+    # 512px tiles keep windowed reads cheap for downstream tools
+    compress='zstd',
+    predictor=3,
+    tiled=True,
+    blockxsize=512,
+    blockysize=512,
+    num_threads='ALL_CPUS',
+    BIGTIFF='IF_SAFER'
 ) as dst:
     dst.write(composite_risk, 1)
 
@@ -317,6 +393,8 @@ print("\nOutput files:")
 if 'flood_risk_utm_path' in locals():
     print(f"  {flood_risk_utm_path}")
     print(f"  {flood_risk_wgs84_path}")
+if 'flood_risk_pmtiles_path' in locals():
+    print(f"  {flood_risk_pmtiles_path}")
 print(f"  {composite_risk_path}")
 
 print("\nNext: Run prepare_layers_v2.py to finalize all outputs")
\ No newline at end of file
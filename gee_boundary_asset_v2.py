@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+GEE Boundary Asset v2: one-time upload of the dissolved UIT boundary
+Dissolves all 11 UIT polygons once and stores the result as an Earth Engine
+table asset, reused by the SAR, HydroSHEDS and water-body scripts
+Re-run only when boundaries.geojson changes
+"""
+
+import ee
+
+from gee_common import BOUNDARY_ASSET, BOUNDARY_FILE, dissolve_boundary_file
+
+uit_boundary = dissolve_boundary_file()
+print(f"✓ Dissolved UIT boundary polygons from {BOUNDARY_FILE}")
+
+# Table exports cannot overwrite, so drop any previous version first
+try:
+    ee.data.getAsset(BOUNDARY_ASSET)
+    ee.data.deleteAsset(BOUNDARY_ASSET)
+    print(f"  Replacing existing asset: {BOUNDARY_ASSET}")
+except ee.EEException:
+    pass
+
+export_task = ee.batch.Export.table.toAsset(
+    collection=ee.FeatureCollection([ee.Feature(uit_boundary, {'name': 'UIT Dausa (all polygons)'})]),
+    description='uit_boundary_dissolved_v2',
+    assetId=BOUNDARY_ASSET
+)
+
+export_task.start()
+
+print("\n" + "="*60)
+print("BOUNDARY ASSET EXPORT STARTED (v2)")
+print("="*60)
+print(f"Task ID: {export_task.id}")
+print(f"Asset: {BOUNDARY_ASSET}")
+print("")
+print("Monitor at: https://code.earthengine.google.com/tasks")
+print("Once complete, the SAR, HydroSHEDS and water-body scripts load it directly")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+GEE Common v2: shared Earth Engine setup for the UIT Dausa GEE scripts
+Initializes Earth Engine once on import and serves the dissolved UIT
+boundary (prebuilt asset from gee_boundary_asset_v2.py, falling back to
+dissolving boundaries.geojson on the fly), memoized per buffer distance
+"""
+
+import functools
+import os
+
+import ee
+import geojson
+
+EE_PROJECT = 'gmail-claude-483711'
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BOUNDARY_FILE = os.path.join(BASE_DIR, 'boundaries.geojson')
+BOUNDARY_ASSET = f'projects/{EE_PROJECT}/assets/uit_boundary_dissolved'
+SLOPE_ASSET = f'projects/{EE_PROJECT}/assets/uit_slope_gt10_30m'
+
+# Initialize Earth Engine
+try:
+    ee.Initialize(project=EE_PROJECT)
+    print("✓ Earth Engine initialized")
+except Exception as e:
+    print(f"✗ Earth Engine initialization failed: {e}")
+    print("Run: earthengine authenticate")
+    exit(1)
+
+
+def dissolve_boundary_file():
+    """Union of all 11 UIT polygons in boundaries.geojson, as one ee.Geometry."""
+    with open(BOUNDARY_FILE) as f:
+        boundary_data = geojson.load(f)
+
+    # One GeoJSON payload for all 11 UIT polygons (handles MultiPolygons natively)
+    return ee.FeatureCollection(boundary_data['features']).geometry().dissolve()
+
+
+@functools.lru_cache(maxsize=8)
+def get_uit_boundary(buffer_m=0):
+    """Dissolved UIT boundary, optionally buffered by buffer_m metres."""
+    if buffer_m:
+        return get_uit_boundary(0).buffer(buffer_m)
+
+    try:
+        ee.data.getAsset(BOUNDARY_ASSET)
+        uit_boundary = ee.FeatureCollection(BOUNDARY_ASSET).geometry()
+    except ee.EEException:
+        print("⚠ Boundary asset not found (run gee_boundary_asset_v2.py), dissolving locally")
+        uit_boundary = dissolve_boundary_file()
+
+    print(f"✓ Loaded all 11 UIT boundary polygons")
+    return uit_boundary
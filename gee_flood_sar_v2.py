@@ -6,39 +6,17 @@ to identify flood-prone areas across entire 1600 sq km region
 """
 
 import ee
-import geojson
 import os
 
-# Initialize Earth Engine
-try:
-    ee.Initialize(project='gmail-claude-483711')
-    print("✓ Earth Engine initialized")
-except Exception as e:
-    print(f"✗ Earth Engine initialization failed: {e}")
-    exit(1)
-
-# Load all 11 UIT boundary polygons
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-BOUNDARY_FILE = os.path.join(BASE_DIR, 'boundaries.geojson')
-
-with open(BOUNDARY_FILE) as f:
-    boundary_data = geojson.load(f)
-
-# Create combined geometry for all 11 UIT polygons
-all_features = []
-for feature in boundary_data['features']:
-    coords = feature['geometry']['coordinates']
-    if feature['geometry']['type'] == 'MultiPolygon':
-        for poly in coords:
-            all_features.append(ee.Geometry.Polygon(poly))
-    else:
-        all_features.append(ee.Geometry.Polygon(coords))
-
-# Union all UIT polygons with buffer for edge effects
-uit_boundary = ee.Geometry.MultiPolygon(all_features).dissolve()
-analysis_region = uit_boundary.buffer(500)
-
-print(f"✓ Loaded all 11 UIT boundary polygons")
+from gee_common import BASE_DIR, SLOPE_ASSET, get_uit_boundary
+from gee_parallel_export import export_image
+
+DATA_DIR = os.path.join(BASE_DIR, 'data-v2')
+DIFF_FILE = os.path.join(DATA_DIR, 'backscatter_difference.tif')
+FLOOD_MASK_FILE = os.path.join(DATA_DIR, 'sar_flood_mask.tif')
+
+# All 11 UIT boundary polygons, buffered for edge effects
+analysis_region = get_uit_boundary(500)
 
 print("\n" + "="*60)
 print("SAR FLOOD ANALYSIS v2 (Full Scale)")
@@ -47,55 +25,54 @@ print("="*60)
 # Sentinel-1 SAR preprocessing function
 def preprocess_s1(image):
     """Preprocess Sentinel-1 image."""
-    # Convert to dB and mask edges
-    db = ee.Image(10).multiply(image.select('VH').log10()).rename('VH_dB')
-    mask = image.select('VH').gt(0.001)  # Remove very low values
-    return db.updateMask(mask)
+    # Convert to dB in one expression and mask edges (very low values)
+    vh = image.select('VH')
+    return vh.expression('10 * log10(b)', {'b': vh}).rename('VH_dB').updateMask(vh.gt(0.001))
+
+# Sentinel-1 IW scenes with VH over the region; only the date window varies
+s1_base = ee.ImageCollection('COPERNICUS/S1_GRD') \
+    .filterBounds(analysis_region) \
+    .filter(ee.Filter.eq('instrumentMode', 'IW')) \
+    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH'))
 
 # 1. Dry Season Composite (January-March 2025)
 print("\n1. Processing dry season SAR (Jan-Mar 2025)...")
 
-dry_season = ee.ImageCollection('COPERNICUS/S1_GRD') \
-    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-    .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-    .filterDate('2025-01-01', '2025-03-31') \
-    .filterBounds(analysis_region) \
-    .map(preprocess_s1)
+dry_season = s1_base.filterDate('2025-01-01', '2025-03-31').map(preprocess_s1)
 
 dry_composite = dry_season.median().clip(analysis_region)
-dry_count = dry_season.size()
-
-print(f"  ✓ Dry season: {dry_count.getInfo()} images")
 
 # 2. Monsoon Season Composite (July-September)
 # Try 2025 first, fall back to 2024 if no data available yet
 print("\n2. Processing monsoon season SAR...")
 
-monsoon_season_2025 = ee.ImageCollection('COPERNICUS/S1_GRD') \
-    .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-    .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-    .filterDate('2025-07-01', '2025-09-30') \
-    .filterBounds(analysis_region)
+monsoon_season_2025 = s1_base.filterDate('2025-07-01', '2025-09-30')
+monsoon_season_2024 = s1_base.filterDate('2024-07-01', '2024-09-30')
 
-monsoon_count_2025 = monsoon_season_2025.size().getInfo()
+# All scene counts in one getInfo round-trip
+scene_counts = ee.Dictionary({
+    'dry': dry_season.size(),
+    'monsoon_2025': monsoon_season_2025.size(),
+    'monsoon_2024': monsoon_season_2024.size(),
+}).getInfo()
+dry_count = scene_counts['dry']
+print(f"  ✓ Dry season: {dry_count} images")
 
-if monsoon_count_2025 > 0:
+if scene_counts['monsoon_2025'] > 0:
     monsoon_year = 2025
     monsoon_season = monsoon_season_2025.map(preprocess_s1)
-    print(f"  ✓ Using 2025 monsoon: {monsoon_count_2025} images")
+    monsoon_count = scene_counts['monsoon_2025']
+    print(f"  ✓ Using 2025 monsoon: {monsoon_count} images")
 else:
     monsoon_year = 2024
     print("  ! No 2025 monsoon data yet, falling back to 2024...")
-    monsoon_season = ee.ImageCollection('COPERNICUS/S1_GRD') \
-        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-        .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-        .filterDate('2024-07-01', '2024-09-30') \
-        .filterBounds(analysis_region) \
-        .map(preprocess_s1)
-    print(f"  ✓ Using 2024 monsoon: {monsoon_season.size().getInfo()} images")
+    monsoon_season = monsoon_season_2024.map(preprocess_s1)
+    monsoon_count = scene_counts['monsoon_2024']
+    print(f"  ✓ Using 2024 monsoon: {monsoon_count} images")
 
-monsoon_composite = monsoon_season.median().clip(analysis_region)
-monsoon_count = monsoon_season.size()
+# Per-pixel minimum: flooding lowers backscatter, so min captures peak
+# inundation (and needs no per-pixel sort, unlike median)
+monsoon_composite = monsoon_season.reduce(ee.Reducer.min()).rename('VH_dB').clip(analysis_region)
 
 # 3. Calculate Backscatter Difference
 print("\n3. Calculating flood extent...")
@@ -107,8 +84,14 @@ flood_mask = backscatter_diff.gt(3.0)  # 3dB drop indicates flooding
 # Additional filters:
 # - Remove very steep slopes (>10°) where flooding is unlikely
 # - Remove areas with very high dry-season backscatter (buildings)
-slope = ee.Terrain.slope(ee.ImageCollection('COPERNICUS/DEM/GLO30').mosaic().select('DEM'))
-steep_areas = slope.gt(10)
+# Steep mask comes precomputed from gee_dem_export_v2.py; rebuild it only if missing
+try:
+    ee.data.getAsset(SLOPE_ASSET)
+    steep_areas = ee.Image(SLOPE_ASSET)
+except ee.EEException:
+    print("  ⚠ Slope asset not found (run gee_dem_export_v2.py), computing from GLO-30")
+    slope = ee.Terrain.slope(ee.ImageCollection('COPERNICUS/DEM/GLO30').mosaic().select('DEM'))
+    steep_areas = slope.gt(10)
 high_backscatter = dry_composite.gt(-5)  # Buildings typically > -5 dB
 
 # Refined flood mask
@@ -116,104 +99,32 @@ flood_refined = flood_mask.And(steep_areas.Not()).And(high_backscatter.Not())
 
 print("✓ Flood extent calculated with terrain filters")
 
-# 4. Vectorize Flood Areas
-print("\n4. Vectorizing flood-prone areas...")
-
-# Group connected flood pixels and vectorize
-flood_vectors = flood_refined.selfMask().reduceToVectors(
-    geometry=analysis_region,
-    scale=20,  # 20m for balance between detail and processing time
-    maxPixels=1e8,
-    geometryType='polygon'
-)
-
-# Add attributes to flood polygons
-def add_flood_attributes(feature):
-    """Add area and flood intensity attributes."""
-    
-    # Calculate area in UTM for accuracy
-    area_utm = feature.geometry().transform('EPSG:32643', 1).area(maxError=1)
-    
-    # Sample backscatter difference at centroid
-    centroid = feature.geometry().centroid(maxError=100)
-    diff_sample = backscatter_diff.sample(centroid, 20).first()
-    flood_intensity = diff_sample.get('VH_dB')
-    
-    return feature.set({
-        'area_sqm': area_utm,
-        'area_hectares': ee.Number(area_utm).divide(10000),
-        'flood_intensity_db': flood_intensity,
-        'flood_category': ee.Algorithms.If(
-            ee.Number(flood_intensity).gt(6), 'high',
-            ee.Algorithms.If(
-                ee.Number(flood_intensity).gt(4), 'moderate',
-                'low'
-            )
-        ),
-        'detection_year': monsoon_year,
-        'data_source': 'Sentinel-1_VH'
-    })
-
-flood_classified = flood_vectors.map(add_flood_attributes)
-
-# Filter out very small flood areas (< 1000 m²)
-flood_filtered = flood_classified.filter(ee.Filter.gte('area_sqm', 1000))
-
-print("✓ Flood areas classified and filtered")
-
-# 5. Export Results
-print("\n5. Exporting flood analysis...")
-
-# Export flood polygons
-flood_export = ee.batch.Export.table.toDrive(
-    collection=flood_filtered,
-    description='uit_dausa_sar_flood_v2',
-    folder='UIT_Dausa_Drainage_v2',
-    fileNamePrefix='sar_flood_full_utm43n',
-    fileFormat='GeoJSON'
-)
-
-flood_export.start()
-
-# Also export backscatter difference raster for analysis
-diff_export = ee.batch.Export.image.toDrive(
-    image=backscatter_diff.select('VH_dB'),
-    description='uit_dausa_backscatter_diff_v2',
-    folder='UIT_Dausa_Drainage_v2',
-    fileNamePrefix='backscatter_difference',
-    scale=20,
-    region=analysis_region,
-    maxPixels=int(1e9),
-    crs='EPSG:32643',
-    fileFormat='GeoTIFF'
-)
-
-diff_export.start()
+# 4. Download Flood Rasters
+# Vectorizing happens locally in postprocess_flood_v2.py (3x3 opening +
+# rasterio shapes), replacing the heavy server-side reduceToVectors
+print("\n4. Downloading flood mask and backscatter difference...")
+
+os.makedirs(DATA_DIR, exist_ok=True)
+export_image(flood_refined.rename('flood').uint8(), analysis_region, FLOOD_MASK_FILE,
+             scale=20, crs='EPSG:32643', nodata=255,
+             tags={'detection_year': monsoon_year})
+
+# Backscatter difference on the same grid, for per-polygon flood intensity
+export_image(backscatter_diff.select('VH_dB'), analysis_region, DIFF_FILE,
+             scale=20, crs='EPSG:32643')
 
 # Print summary
 print("\n" + "="*60)
-print("SAR FLOOD ANALYSIS EXPORT STARTED (v2)")
+print("SAR FLOOD ANALYSIS COMPLETE (v2)")
 print("="*60)
-print(f"Flood polygons task ID: {flood_export.id}")
-print(f"Backscatter raster task ID: {diff_export.id}")
+print(f"Flood mask saved: {FLOOD_MASK_FILE}")
+print(f"Backscatter raster saved: {DIFF_FILE}")
 print("")
 print("Analysis parameters:")
-print(f"  Dry season: Jan-Mar 2025 ({dry_count.getInfo()} images)")
-print(f"  Monsoon season: Jul-Sep {monsoon_year} ({monsoon_count.getInfo()} images)")
+print(f"  Dry season: Jan-Mar 2025 median ({dry_count} images)")
+print(f"  Monsoon season: Jul-Sep {monsoon_year} minimum ({monsoon_count} images)")
 print("  Flood threshold: >3dB backscatter decrease")
-print("  Minimum area: 1000 m² (0.1 hectare)")
 print("  Excluded: steep slopes (>10°) and buildings")
-print("")
-print("Monitor at: https://code.earthengine.google.com/tasks")
-print("Download to: layers-v2/sar_flood_full_utm43n.geojson")
 
-# Get approximate statistics
-try:
-    flood_count = flood_filtered.size()
-    total_area = flood_filtered.aggregate_sum('area_hectares')
-    print(f"\nFlood-prone areas detected: {flood_count.getInfo()}")
-    print(f"Total flood-prone area: {total_area.getInfo():.1f} hectares")
-except Exception as e:
-    print("\nFlood statistics: (calculating in background)")
-
-print("\nNext: Run gee_hydrosheds_v2.py for reference network")
\ No newline at end of file
+print("\nNext: Run postprocess_flood_v2.py to vectorize flood areas")
+print("Then: Run gee_hydrosheds_v2.py for reference network")
@@ -6,39 +6,17 @@ to use as validation reference for our DEM-derived streams
 """
 
 import ee
-import geojson
+import geopandas as gpd
 import os
 
-# Initialize Earth Engine
-try:
-    ee.Initialize(project='gmail-claude-483711')
-    print("✓ Earth Engine initialized")
-except Exception as e:
-    print(f"✗ Earth Engine initialization failed: {e}")
-    exit(1)
-
-# Load all 11 UIT boundary polygons
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-BOUNDARY_FILE = os.path.join(BASE_DIR, 'boundaries.geojson')
-
-with open(BOUNDARY_FILE) as f:
-    boundary_data = geojson.load(f)
-
-# Create combined geometry for all 11 UIT polygons
-all_features = []
-for feature in boundary_data['features']:
-    coords = feature['geometry']['coordinates']
-    if feature['geometry']['type'] == 'MultiPolygon':
-        for poly in coords:
-            all_features.append(ee.Geometry.Polygon(poly))
-    else:
-        all_features.append(ee.Geometry.Polygon(coords))
-
-# Union all UIT polygons with buffer for context
-uit_boundary = ee.Geometry.MultiPolygon(all_features).dissolve()
-analysis_region = uit_boundary.buffer(2000)  # 2km buffer for regional context
-
-print(f"✓ Loaded all 11 UIT boundary polygons")
+from gee_common import BASE_DIR, get_uit_boundary
+
+LAYERS_DIR = os.path.join(BASE_DIR, 'layers-v2')
+HYDROSHEDS_FILE = os.path.join(LAYERS_DIR, 'hydrosheds_ref_full_utm43n.geojson')
+
+# All 11 UIT boundary polygons
+analysis_region = get_uit_boundary(2000)  # 2km buffer for regional context
+
 print(f"Analysis region: UIT boundaries + 2km buffer")
 
 print("\n" + "="*60)
@@ -68,56 +46,51 @@ rivers_with_length = rivers_in_region.map(add_utm_length)
 
 print("✓ Added UTM-based length calculations")
 
-# Print basic statistics
-river_count = rivers_with_length.size()
-total_length = rivers_with_length.aggregate_sum('LENGTH_UTM_KM')
+# Count and length per river order (evaluated server-side)
+def order_stats(order):
+    filtered = rivers_with_length.filter(ee.Filter.eq('RIV_ORD', order))
+    return ee.Dictionary({
+        'order': order,
+        'count': filtered.size(),
+        'length_km': filtered.aggregate_sum('LENGTH_UTM_KM')
+    })
 
+# All statistics in one server-side dictionary -> a single getInfo round-trip
 print(f"\n2. HydroSHEDS Statistics:")
 try:
-    print(f"  River segments in region: {river_count.getInfo()}")
-    print(f"  Total river length: {total_length.getInfo():.1f} km")
-    
-    # Get range of river orders
-    orders = rivers_with_length.aggregate_array('RIV_ORD').distinct().sort()
-    print(f"  River orders present: {orders.getInfo()}")
-    
-    # Count by order (batched to avoid many getInfo calls)
-    def order_stats(order):
-        filtered = rivers_with_length.filter(ee.Filter.eq('RIV_ORD', order))
-        return ee.Feature(None, {
-            'order': order,
-            'count': filtered.size(),
-            'length_km': filtered.aggregate_sum('LENGTH_UTM_KM')
-        })
-
-    stats_fc = ee.FeatureCollection([order_stats(o) for o in [3, 4, 5, 6, 7, 8, 9]])
-    stats_list = stats_fc.getInfo()['features']
-    for stat in stats_list:
-        props = stat['properties']
-        if props['count'] > 0:
-            print(f"    Order {props['order']}: {props['count']} segments, {props['length_km']:.1f} km")
-            
+    summary = ee.Dictionary({
+        'count': rivers_with_length.size(),
+        'length_km': rivers_with_length.aggregate_sum('LENGTH_UTM_KM'),
+        'orders': rivers_with_length.aggregate_array('RIV_ORD').distinct().sort(),
+        'by_order': ee.List([order_stats(o) for o in [3, 4, 5, 6, 7, 8, 9]]),
+    }).getInfo()
+
+    print(f"  River segments in region: {summary['count']}")
+    print(f"  Total river length: {summary['length_km']:.1f} km")
+    print(f"  River orders present: {summary['orders']}")
+    for stat in summary['by_order']:
+        if stat['count'] > 0:
+            print(f"    Order {stat['order']}: {stat['count']} segments, {stat['length_km']:.1f} km")
+
 except Exception as e:
     print("  Statistics: (calculating in background)")
 
 # 3. Export HydroSHEDS Reference
 print("\n3. Exporting HydroSHEDS reference...")
 
-export_task = ee.batch.Export.table.toDrive(
-    collection=rivers_with_length,
-    description='uit_dausa_hydrosheds_ref_v2',
-    folder='UIT_Dausa_Drainage_v2',
-    fileNamePrefix='hydrosheds_ref_full_utm43n',
-    fileFormat='GeoJSON'
-)
+# Fetched directly (a few hundred segments), no Drive batch export
+rivers_gdf = gpd.GeoDataFrame(ee.data.computeFeatures({
+    'expression': rivers_with_length,
+    'fileFormat': 'GEOPANDAS_GEODATAFRAME',
+}), crs='EPSG:4326')
 
-export_task.start()
+os.makedirs(LAYERS_DIR, exist_ok=True)
+rivers_gdf.to_file(HYDROSHEDS_FILE, driver='GeoJSON', engine='pyogrio')
 
 print("\n" + "="*60)
-print("HYDROSHEDS EXPORT STARTED (v2)")
+print("HYDROSHEDS EXPORT COMPLETE (v2)")
 print("="*60)
-print(f"Task ID: {export_task.id}")
-print(f"Description: uit_dausa_hydrosheds_ref_v2")
+print(f"Output: {HYDROSHEDS_FILE} ({len(rivers_gdf)} segments)")
 print(f"Coverage: All 11 UIT polygons + 2km buffer")
 print("")
 print("HydroSHEDS attributes included:")
@@ -132,9 +105,6 @@ print("  - Compare Order 3+ streams from hydro_process_v2.py")
 print("  - Check spatial alignment of major drainage")
 print("  - Validate Strahler ordering consistency")
 print("")
-print("Monitor at: https://code.earthengine.google.com/tasks")
-print("Download to: layers-v2/hydrosheds_ref_full_utm43n.geojson")
-print("")
 print("Next: Run hydro_process_v2.py (ensure DEM is downloaded first)")
 
 # Additional analysis for reference
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+GEE Parallel Export: tiled downloads for UIT Dausa rasters and vectors
+Fetches an ee.Image straight to a local GeoTIFF (computePixels) or a
+per-tile FeatureCollection to a GeoDataFrame (computeFeatures) through the
+high-volume endpoint, one request per tile, instead of queueing Drive exports
+"""
+
+import math
+import multiprocessing
+import os
+
+import ee
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.merge import merge
+from rasterio.warp import transform_bounds
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from gee_common import EE_PROJECT
+
+HIGH_VOLUME_URL = 'https://earthengine-highvolume.googleapis.com'
+
+# computePixels responses are capped at 32 MB; 1024 x 1024 float32 is 4 MB,
+# and small enough that a ~1600 km² region still splits into several tiles
+TILE_PX = 1024
+
+# Vector tiles: ~10 km squares keep each reduceToVectors far below maxPixels
+# and each computeFeatures response well under the request-size limits
+TILE_DEG = 0.1
+
+
+def _init_worker():
+    """Give each worker process its own client on the high-volume endpoint."""
+    ee.Initialize(project=EE_PROJECT, opt_url=HIGH_VOLUME_URL)
+
+
+def _fetch_tile(expression, grid, tile_path):
+    """Fetch one tile as GeoTIFF bytes and write it to tile_path."""
+    image = ee.deserializer.fromJSON(expression)
+    data = ee.data.computePixels({
+        'expression': image,
+        'fileFormat': 'GEO_TIFF',
+        'grid': grid,
+    })
+    with open(tile_path, 'wb') as f:
+        f.write(data)
+    return tile_path
+
+
+def _fetch_features(expression):
+    """Evaluate one serialized FeatureCollection to a GeoDataFrame."""
+    collection = ee.deserializer.fromJSON(expression)
+    return ee.data.computeFeatures({
+        'expression': collection,
+        'fileFormat': 'GEOPANDAS_GEODATAFRAME',
+    })
+
+
+def _lonlat_bounds(region):
+    """(west, south, east, north) of an ee.Geometry (one RPC)."""
+    ring = region.bounds().coordinates().getInfo()[0]
+    lons = [p[0] for p in ring]
+    lats = [p[1] for p in ring]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def tile_grids(bounds, scale, crs, tile_px=TILE_PX):
+    """Split (xmin, ymin, xmax, ymax) into pixel-snapped computePixels grids."""
+    xmin = math.floor(bounds[0] / scale) * scale
+    ymax = math.ceil(bounds[3] / scale) * scale
+    width = math.ceil((bounds[2] - xmin) / scale)
+    height = math.ceil((ymax - bounds[1]) / scale)
+
+    grids = []
+    for row in range(0, height, tile_px):
+        for col in range(0, width, tile_px):
+            grids.append({
+                'dimensions': {
+                    'width': min(tile_px, width - col),
+                    'height': min(tile_px, height - row),
+                },
+                'affineTransform': {
+                    'scaleX': scale, 'shearX': 0, 'translateX': xmin + col * scale,
+                    'shearY': 0, 'scaleY': -scale, 'translateY': ymax - row * scale,
+                },
+                'crsCode': crs,
+            })
+    return grids
+
+
+def export_image(image, region, out_path, scale, crs='EPSG:32643',
+                 nodata=-9999.0, workers=8, tile_px=TILE_PX, tags=None):
+    """Download image over region to out_path as a single GeoTIFF.
+
+    Masked pixels are filled with nodata, which is tagged on the output.
+    Tiles are kept under data-v2/tiles/<name>/ next to the mosaic. Optional
+    tags (e.g. the detection year) are written as GeoTIFF metadata.
+    """
+    # Region bounds in the output CRS (one RPC for the lon/lat bbox)
+    bounds = transform_bounds('EPSG:4326', crs, *_lonlat_bounds(region))
+
+    grids = tile_grids(bounds, scale, crs, tile_px)
+    name = os.path.splitext(os.path.basename(out_path))[0]
+    tiles_dir = os.path.join(os.path.dirname(out_path), 'tiles', name)
+    os.makedirs(tiles_dir, exist_ok=True)
+    tile_paths = [os.path.join(tiles_dir, f'{name}_{i:03d}.tif') for i in range(len(grids))]
+
+    expression = image.unmask(nodata, False).serialize()
+    print(f"  Fetching {len(grids)} tiles of {tile_px}px ({workers} workers, high-volume endpoint)...")
+
+    # fork: workers must not re-run the calling script's top-level code
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(min(workers, len(grids)), initializer=_init_worker) as pool:
+        pool.starmap(_fetch_tile, [(expression, g, p) for g, p in zip(grids, tile_paths)])
+
+    # Mosaic tiles into the final raster
+    sources = [rasterio.open(p) for p in tile_paths]
+    try:
+        mosaic, mosaic_transform = merge(sources, nodata=nodata)
+        profile = sources[0].profile.copy()
+    finally:
+        for src in sources:
+            src.close()
+
+    profile.update(
+        driver='GTiff',
+        height=mosaic.shape[1],
+        width=mosaic.shape[2],
+        count=mosaic.shape[0],
+        transform=mosaic_transform,
+        nodata=nodata,
+        compress='zstd',
+        predictor=3 if np.issubdtype(mosaic.dtype, np.floating) else 2,
+        tiled=True,
+        blockxsize=512,
+        blockysize=512,
+    )
+    with rasterio.open(out_path, 'w', **profile) as dst:
+        dst.write(mosaic)
+        if tags:
+            dst.update_tags(**tags)
+
+    print(f"  ✓ Mosaic saved: {out_path} ({profile['width']} x {profile['height']} pixels)")
+    return out_path
+
+
+def export_vectors(build_tile, region, tile_deg=TILE_DEG, workers=8):
+    """Evaluate build_tile(tile_geometry) per lon/lat tile and return one GeoDataFrame.
+
+    build_tile runs locally and must return the ee.FeatureCollection for a
+    single tile (e.g. reduceToVectors over that tile). Only the serialized
+    collections are sent to the worker processes. Pieces split at tile seams
+    are not merged here; see stitch_tile_seams.
+    """
+    west, south, east, north = _lonlat_bounds(region)
+    boxes = [
+        [float(x), float(y), float(min(x + tile_deg, east)), float(min(y + tile_deg, north))]
+        for y in np.arange(south, north, tile_deg)
+        for x in np.arange(west, east, tile_deg)
+    ]
+    expressions = [build_tile(ee.Geometry.Rectangle(box)).serialize() for box in boxes]
+    print(f"  Vectorizing {len(boxes)} tiles of {tile_deg}° ({workers} workers, high-volume endpoint)...")
+
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(min(workers, len(boxes)), initializer=_init_worker) as pool:
+        parts = pool.map(_fetch_features, expressions)
+
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return gpd.GeoDataFrame(geometry=[], crs='EPSG:4326')
+    gdf = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs='EPSG:4326')
+    print(f"  ✓ {len(gdf)} features from {len(parts)} non-empty tiles")
+    return gdf
+
+
+def stitch_tile_seams(gdf):
+    """Label pieces of the same polygon that were cut at tile seams.
+
+    reduceToVectors polygons are 8-connected, so within one tile distinct
+    polygons never touch; any two pieces that intersect must be one polygon
+    split across a seam. Returns an integer group label per row.
+    """
+    left, right = gdf.sindex.query(gdf.geometry, predicate='intersects')
+    graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(len(gdf), len(gdf)))
+    _, labels = connected_components(graph, directed=False)
+    return labels
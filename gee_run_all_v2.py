@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+GEE Run All v2: launch the four UIT Dausa GEE scripts concurrently
+Each script runs in its own interpreter with its own Earth Engine session,
+so their init, getInfo and export-submission latencies overlap instead of
+adding up. The SAR script reads the steep-slope asset that the DEM script
+maintains, so it is only launched once the DEM script has finished.
+Output is printed per script as each one finishes.
+"""
+
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = [
+    'gee_dem_export_v2.py',
+    'gee_water_bodies_v2.py',
+    'gee_flood_sar_v2.py',
+    'gee_hydrosheds_v2.py',
+]
+
+# Scripts that must wait for another script to finish first
+RUN_AFTER = {
+    'gee_flood_sar_v2.py': 'gee_dem_export_v2.py',
+}
+
+
+def run_script(script):
+    """Run one GEE script; returns (script, exit code, output, seconds)."""
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, os.path.join(BASE_DIR, script)],
+        cwd=BASE_DIR, capture_output=True, text=True
+    )
+    return script, result.returncode, result.stdout + result.stderr, time.time() - start
+
+
+print("="*60)
+print(f"GEE EXPORTS v2 — running {len(SCRIPTS)} scripts concurrently")
+print("="*60)
+
+failed = []
+start = time.time()
+with ThreadPoolExecutor(max_workers=len(SCRIPTS)) as ex:
+    pending = {ex.submit(run_script, script) for script in SCRIPTS if script not in RUN_AFTER}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            script, returncode, output, seconds = future.result()
+            status = "✓" if returncode == 0 else f"✗ exit {returncode}"
+            print(f"\n{'-'*60}\n{script}: {status} ({seconds:.0f}s)\n{'-'*60}")
+            print(output.rstrip())
+            if returncode != 0:
+                failed.append(script)
+
+            # Launch scripts that were waiting on this one (the SAR script
+            # falls back to computing slope itself if the asset is missing)
+            pending |= {ex.submit(run_script, waiting)
+                        for waiting, first in RUN_AFTER.items() if first == script}
+
+print("\n" + "="*60)
+print(f"ALL GEE SCRIPTS FINISHED ({time.time() - start:.0f}s wall time)")
+print("="*60)
+if failed:
+    print(f"✗ Failed: {', '.join(failed)}")
+    exit(1)
+print("✓ All scripts completed")
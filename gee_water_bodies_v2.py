@@ -8,41 +8,18 @@ Export in UTM Zone 43N projection
 """
 
 import ee
-import geojson
 import os
+import geopandas as gpd
 from datetime import datetime
 
-# Initialize Earth Engine
-try:
-    ee.Initialize(project='gmail-claude-483711')
-    print("✓ Earth Engine initialized")
-except Exception as e:
-    print(f"✗ Earth Engine initialization failed: {e}")
-    exit(1)
-
-# Load all 11 UIT boundary polygons
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-BOUNDARY_FILE = os.path.join(BASE_DIR, 'boundaries.geojson')
-
-with open(BOUNDARY_FILE) as f:
-    boundary_data = geojson.load(f)
-
-# Create combined geometry for all 11 UIT polygons
-all_features = []
-for feature in boundary_data['features']:
-    coords = feature['geometry']['coordinates']
-    if feature['geometry']['type'] == 'MultiPolygon':
-        for poly in coords:
-            all_features.append(ee.Geometry.Polygon(poly))
-    else:
-        all_features.append(ee.Geometry.Polygon(coords))
-
-# Union all UIT polygons
-uit_boundary = ee.Geometry.MultiPolygon(all_features).dissolve()
-print(f"✓ Loaded all 11 UIT boundary polygons")
-
-# Extended region for analysis (buffer 1km for edge effects)
-analysis_region = uit_boundary.buffer(1000)
+from gee_common import BASE_DIR, get_uit_boundary
+from gee_parallel_export import export_vectors, stitch_tile_seams
+
+LAYERS_DIR = os.path.join(BASE_DIR, 'layers-v2')
+WATER_BODIES_FILE = os.path.join(LAYERS_DIR, 'water_bodies_full_utm43n.geojson')
+
+# All 11 UIT boundary polygons, extended for analysis (buffer 1km for edge effects)
+analysis_region = get_uit_boundary(1000)
 
 print("\n" + "="*60)
 print("WATER BODY DETECTION v2 (Full Scale)")
@@ -71,12 +48,12 @@ print("✓ JRC water categories extracted")
 # 2. Sentinel-2 MNDWI Analysis
 print("\n2. Sentinel-2 MNDWI Analysis...")
 
-def get_s2_water_composite(start_date, end_date, description):
-    """Get Sentinel-2 water composite for date range."""
+def get_s2_water_composite(start_date, end_date):
+    """Get Sentinel-2 water mask and (server-side) scene count for date range."""
     
     s2 = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
-        .filterDate(start_date, end_date) \
         .filterBounds(analysis_region) \
+        .filterDate(start_date, end_date) \
         .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 30))
     
     def add_water_indices(image):
@@ -91,102 +68,95 @@ def get_s2_water_composite(start_date, end_date, description):
     composite = s2_indices.median().clip(analysis_region)
     water_mask = composite.select('MNDWI').gt(0)
     
-    print(f"  ✓ {description}: {s2.size().getInfo()} images")
-    return water_mask
+    return water_mask, s2.size()
 
 # Pre-monsoon (April-May 2025) and Post-monsoon (October-November 2025)
-pre_monsoon_water = get_s2_water_composite('2025-04-01', '2025-05-31', 'Pre-monsoon')
-post_monsoon_water = get_s2_water_composite('2025-10-01', '2025-11-30', 'Post-monsoon')
+pre_monsoon_water, pre_count = get_s2_water_composite('2025-04-01', '2025-05-31')
+post_monsoon_water, post_count = get_s2_water_composite('2025-10-01', '2025-11-30')
+
+# Both scene counts in one getInfo round-trip
+s2_counts = ee.Dictionary({'pre': pre_count, 'post': post_count}).getInfo()
+print(f"  ✓ Pre-monsoon: {s2_counts['pre']} images")
+print(f"  ✓ Post-monsoon: {s2_counts['post']} images")
 
 # 3. Combine and Vectorize Water Bodies
 print("\n3. Combining and Vectorizing Water Bodies...")
 
-# Create combined water mask with categories
-water_categories = ee.Image.constant(0).clip(analysis_region)
-
-# Add categories (higher values override lower)
-water_categories = water_categories.where(historical_extent, 1)  # Historical
-water_categories = water_categories.where(seasonal_water, 2)     # Seasonal JRC
-water_categories = water_categories.where(permanent_water, 3)    # Permanent JRC
-water_categories = water_categories.where(pre_monsoon_water, 4)  # Pre-monsoon S2
-water_categories = water_categories.where(post_monsoon_water, 5) # Post-monsoon S2
+# Create combined water mask with categories in one expression (higher
+# values override lower); unmask(0) keeps where()'s handling of masked pixels
+water_categories = ee.Image(0).expression(
+    '(post > 0) ? 5 : (pre > 0) ? 4 : (perm > 0) ? 3 : (seas > 0) ? 2 : (hist > 0) ? 1 : 0', {
+        'post': post_monsoon_water.unmask(0),  # Post-monsoon S2
+        'pre': pre_monsoon_water.unmask(0),    # Pre-monsoon S2
+        'perm': permanent_water.unmask(0),     # Permanent JRC
+        'seas': seasonal_water.unmask(0),      # Seasonal JRC
+        'hist': historical_extent.unmask(0),   # Historical
+    }
+).rename('category').clip(analysis_region)
+
+# Vectorize water bodies tile by tile (in parallel) so no single
+# reduceToVectors nears maxPixels or the response-size limits
+def water_tile(tile):
+    """Water polygons for one tile, with their dominant (mode) category."""
+    vectors = water_categories.gt(0).selfMask().reduceToVectors(
+        geometry=tile,
+        scale=30,
+        maxPixels=1e8,
+        geometryType='polygon'
+    )
+    return water_categories.reduceRegions(
+        collection=vectors,
+        reducer=ee.Reducer.mode().setOutputs(['category_code']),
+        scale=30
+    )
 
-# Vectorize water bodies
-water_vectors = water_categories.gt(0).selfMask().reduceToVectors(
-    geometry=analysis_region,
-    scale=30,
-    maxPixels=1e8,
-    geometryType='polygon'
-)
+water_pieces = export_vectors(water_tile, analysis_region)
 
 print("✓ Water bodies vectorized")
 
 # 4. Add Attributes and Classification
-def classify_water_body(feature):
-    """Classify water body type and add attributes."""
-    
-    # Sample the dominant water category across the polygon (mode)
-    category = water_categories.reduceRegion(
-        reducer=ee.Reducer.mode(),
-        geometry=feature.geometry(),
-        scale=30,
-        maxPixels=1e6
-    ).get('constant')
-    
-    # Calculate area in UTM projection for accuracy
-    area_utm = feature.geometry().transform('EPSG:32643', 1).area(maxError=1)
-    
-    # Assign water type based on category
-    water_type = ee.Algorithms.If(
-        ee.Number(category).eq(5), 'post_monsoon_s2',
-        ee.Algorithms.If(
-            ee.Number(category).eq(4), 'pre_monsoon_s2',
-            ee.Algorithms.If(
-                ee.Number(category).eq(3), 'permanent_jrc',
-                ee.Algorithms.If(
-                    ee.Number(category).eq(2), 'seasonal_jrc',
-                    'historical_jrc'
-                )
-            )
-        )
-    )
-    
-    return feature.set({
-        'water_type': water_type,
-        'area_sqm': area_utm,
-        'area_hectares': ee.Number(area_utm).divide(10000),
-        'category_code': category,
-        'detection_source': ee.String(water_type).slice(0, 3)  # 'jrc' or 'sen'
-    })
-
 print("\n4. Adding water body attributes...")
-water_classified = water_vectors.map(classify_water_body)
 
-# Filter out very small water bodies (< 100 m²)
-water_filtered = water_classified.filter(ee.Filter.gte('area_sqm', 100))
+WATER_TYPES = {
+    5: 'post_monsoon_s2',
+    4: 'pre_monsoon_s2',
+    3: 'permanent_jrc',
+    2: 'seasonal_jrc',
+}
+water_columns = ['water_type', 'area_sqm', 'area_hectares', 'category_code',
+                 'detection_source', 'geometry']
+
+if len(water_pieces):
+    # Merge polygons cut at tile seams; the largest piece's category wins
+    water_pieces['area_sqm'] = water_pieces.to_crs('EPSG:32643').area
+    water_pieces['polygon_id'] = stitch_tile_seams(water_pieces)
+    water_gdf = water_pieces.sort_values('area_sqm', ascending=False)[
+        ['polygon_id', 'area_sqm', 'category_code', 'geometry']
+    ].dissolve(by='polygon_id', aggfunc={'area_sqm': 'sum', 'category_code': 'first'}).reset_index(drop=True)
+
+    # Assign water type based on category
+    water_gdf['water_type'] = water_gdf['category_code'].map(WATER_TYPES).fillna('historical_jrc')
+    water_gdf['area_hectares'] = water_gdf['area_sqm'] / 10000
+    water_gdf['detection_source'] = water_gdf['water_type'].str[:3]  # 'jrc' or 'sen'
+
+    # Filter out very small water bodies (< 100 m²)
+    water_filtered = water_gdf.loc[water_gdf['area_sqm'] >= 100, water_columns]
+else:
+    water_filtered = gpd.GeoDataFrame(columns=water_columns, geometry='geometry', crs='EPSG:4326')
 
 print("✓ Water body classification complete")
 
-# 5. Export to Drive (as GeoJSON for UTM preservation)
+# 5. Save water bodies (WGS84 GeoJSON, same layout as the former Drive export)
 print("\n5. Exporting water bodies...")
 
-# Export as FeatureCollection to preserve UTM coordinates in properties
-export_task = ee.batch.Export.table.toDrive(
-    collection=water_filtered,
-    description='uit_dausa_water_bodies_v2',
-    folder='UIT_Dausa_Drainage_v2',
-    fileNamePrefix='water_bodies_full_utm43n',
-    fileFormat='GeoJSON'
-)
-
-export_task.start()
+os.makedirs(LAYERS_DIR, exist_ok=True)
+water_filtered.to_file(WATER_BODIES_FILE, driver='GeoJSON', engine='pyogrio')
 
 # Print summary statistics
 print("\n" + "="*60)
-print("WATER BODIES EXPORT STARTED (v2)")
+print("WATER BODIES EXPORT COMPLETE (v2)")
 print("="*60)
-print(f"Task ID: {export_task.id}")
-print(f"Description: uit_dausa_water_bodies_v2")
+print(f"Output: {WATER_BODIES_FILE}")
 print(f"Coverage: All 11 UIT polygons (~1600 sq km)")
 print(f"Minimum water body size: 100 m²")
 print("")
@@ -196,15 +166,7 @@ print("  2. seasonal_jrc (JRC occurrence 20-80%)")
 print("  3. historical_jrc (JRC max extent)")
 print("  4. pre_monsoon_s2 (Sentinel-2 Apr-May 2025)")
 print("  5. post_monsoon_s2 (Sentinel-2 Oct-Nov 2025)")
-print("")
-print("Monitor at: https://code.earthengine.google.com/tasks")
-print("Download to: layers-v2/water_bodies_full_utm43n.geojson")
 
-# Get approximate count for reporting
-try:
-    water_count = water_filtered.size()
-    print(f"\nApproximate water bodies detected: {water_count.getInfo()}")
-except Exception as e:
-    print(f"\nWater body count: (calculating in background)")
+print(f"\nWater bodies detected: {len(water_filtered)}")
 
-print("\nNext: Run gee_flood_sar_v2.py for SAR flood analysis")
\ No newline at end of file
+print("\nNext: Run gee_flood_sar_v2.py for SAR flood analysis")
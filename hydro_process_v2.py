@@ -9,14 +9,23 @@ Process 1600 sq km DEM with updated client requirements:
 4. Full coverage of all 11 UIT polygons
 """
 
+import atexit
+import math
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import rasterio
 import geopandas as gpd
-from rasterio.transform import rowcol
-from shapely.geometry import Point, Polygon, LineString, shape
+import shapely
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from shapely.geometry import Polygon, LineString, shape
 from rasterio.features import shapes as rio_shapes
+from rasterio.enums import Resampling
 from scipy import ndimage
+from numba import njit
 import whitebox
 
 print("\n" + "="*70)
@@ -34,6 +43,16 @@ LAYERS_DIR = os.path.join(BASE_DIR, 'layers-v2')
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(LAYERS_DIR, exist_ok=True)
 
+# Files that only pass between WhiteboxTools steps (stream raster/vector,
+# pour points, watershed labels) go to tmpfs when available and are removed
+# on exit; set SAVE_INTERMEDIATE to keep them in data-v2 for inspection
+SAVE_INTERMEDIATE = False
+if SAVE_INTERMEDIATE:
+    SCRATCH_DIR = DATA_DIR
+else:
+    SCRATCH_DIR = tempfile.mkdtemp(prefix='uit_hydro_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    atexit.register(shutil.rmtree, SCRATCH_DIR, ignore_errors=True)
+
 # Input DEM file (should be downloaded from GEE export)
 DEM_FILE = os.path.join(DATA_DIR, 'dem_full_utm43n.tif')
 
@@ -46,7 +65,7 @@ print(f"DEM file found: {DEM_FILE}")
 
 # Load UIT boundaries for context
 BOUNDARY_FILE = os.path.join(BASE_DIR, 'boundaries.geojson')
-boundaries = gpd.read_file(BOUNDARY_FILE)
+boundaries = gpd.read_file(BOUNDARY_FILE, engine='pyogrio')
 if boundaries.crs != 'EPSG:32643':
     boundaries = boundaries.to_crs('EPSG:32643')
     print(f"Boundaries reprojected to UTM 43N")
@@ -58,24 +77,34 @@ print(f"Loaded {len(boundaries)} UIT boundary polygons")
 print("\n1. Preprocessing DEM (fix nodata)...")
 
 DEM_FIXED = os.path.join(DATA_DIR, 'dem_full_utm43n_fixed.tif')
+NODATA_VAL = -9999.0
+
+nan_count = 0
+elev_min, elev_max = np.inf, -np.inf
 with rasterio.open(DEM_FILE) as src:
     profile = src.profile.copy()
-    data = src.read(1)
+    profile.update(nodata=NODATA_VAL)
     dem_crs = src.crs
     dem_transform = src.transform
     dem_bounds = src.bounds
-
-NODATA_VAL = -9999.0
-nan_count = np.isnan(data).sum()
-data[np.isnan(data)] = NODATA_VAL
-profile.update(nodata=NODATA_VAL)
-with rasterio.open(DEM_FIXED, 'w', **profile) as dst:
-    dst.write(data, 1)
-
-valid_data = data[data != NODATA_VAL]
-print(f"  DEM shape: {data.shape} ({data.shape[0]*30/1000:.0f} km x {data.shape[1]*30/1000:.0f} km)")
-print(f"  Elevation range: {valid_data.min():.1f} to {valid_data.max():.1f} m")
-print(f"  NoData cells: {nan_count} ({nan_count/data.size*100:.1f}%)")
+    dem_shape = src.shape
+
+    # Rewrite NaN -> nodata block by block, so only one block is in memory
+    with rasterio.open(DEM_FIXED, 'w', **profile) as dst:
+        for _, window in src.block_windows(1):
+            block = src.read(1, window=window)
+            nan_mask = np.isnan(block)
+            nan_count += int(nan_mask.sum())
+            block[nan_mask] = NODATA_VAL
+            valid_block = block[block != NODATA_VAL]
+            if valid_block.size:
+                elev_min = min(elev_min, valid_block.min())
+                elev_max = max(elev_max, valid_block.max())
+            dst.write(block, 1, window=window)
+
+print(f"  DEM shape: {dem_shape} ({dem_shape[0]*30/1000:.0f} km x {dem_shape[1]*30/1000:.0f} km)")
+print(f"  Elevation range: {elev_min:.1f} to {elev_max:.1f} m")
+print(f"  NoData cells: {nan_count} ({nan_count/(dem_shape[0]*dem_shape[1])*100:.1f}%)")
 print(f"  Resolution: {dem_transform[0]:.1f}m x {-dem_transform[4]:.1f}m")
 print(f"  CRS: {dem_crs}")
 
@@ -106,10 +135,76 @@ print("  D8 flow direction computed")
 print("\n4. Computing D8 flow accumulation...")
 
 ACC_FILE = os.path.join(DATA_DIR, 'flow_acc_wbt.tif')
-wbt.d8_flow_accumulation(DEM_BREACHED, ACC_FILE, out_type='cells')
 
-with rasterio.open(ACC_FILE) as src:
-    acc_data = src.read(1)
+# WhiteboxTools D8 pointer codes and their (row, col) offsets:
+#   64 128   1
+#   32   0   2
+#   16   8   4
+D8_CODES = np.array([1, 2, 4, 8, 16, 32, 64, 128])
+D8_DROW = np.array([-1, 0, 1, 1, 1, 0, -1, -1])
+D8_DCOL = np.array([1, 1, 1, 0, -1, -1, -1, 0])
+
+@njit(cache=True)
+def d8_accumulation(pointer, valid):
+    """D8 flow accumulation in cells (each cell counts itself) from a WBT pointer grid.
+
+    Cells are drained in topological order (a cell is released once all of
+    its upstream neighbours have drained into it), so breached flats need no
+    elevation sort. Flow into invalid or off-grid cells stops there.
+    """
+    H, W = pointer.shape
+    valid_flat = valid.ravel()
+    receiver = np.full(H * W, -1, dtype=np.int64)
+    n_upstream = np.zeros(H * W, dtype=np.int32)
+    for i in range(H):
+        for j in range(W):
+            if not valid[i, j]:
+                continue
+            for k in range(8):
+                if pointer[i, j] == D8_CODES[k]:
+                    ni = i + D8_DROW[k]
+                    nj = j + D8_DCOL[k]
+                    if 0 <= ni < H and 0 <= nj < W and valid[ni, nj]:
+                        receiver[i * W + j] = ni * W + nj
+                        n_upstream[ni * W + nj] += 1
+                    break
+
+    acc = np.zeros(H * W, dtype=np.int32)
+    stack = np.empty(H * W, dtype=np.int64)
+    top = 0
+    for idx in range(H * W):
+        if valid_flat[idx]:
+            acc[idx] = 1
+            if n_upstream[idx] == 0:
+                stack[top] = idx
+                top += 1
+    while top > 0:
+        top -= 1
+        idx = stack[top]
+        r = receiver[idx]
+        if r >= 0:
+            acc[r] += acc[idx]
+            n_upstream[r] -= 1
+            if n_upstream[r] == 0:
+                stack[top] = r
+                top += 1
+    return acc.reshape(H, W)
+
+# Accumulate in-process over the D8 pointer (needed by the WBT stream tools
+# anyway) instead of a second WBT pass that re-derives it from the DEM
+with rasterio.open(FDIR_FILE) as src:
+    fdir_data = src.read(1)
+    fdir_valid = fdir_data != src.nodata
+    acc_profile = src.profile.copy()
+
+acc_data = d8_accumulation(fdir_data, fdir_valid)
+acc_data[~fdir_valid] = int(NODATA_VAL)
+
+# extract_streams reads the accumulation from disk; cell counts fit int32
+acc_profile.update(dtype='int32', nodata=int(NODATA_VAL))
+with rasterio.open(ACC_FILE, 'w', **acc_profile) as dst:
+    dst.write(acc_data, 1)
+
 max_acc = np.nanmax(acc_data)
 print(f"  Max accumulation: {max_acc:.0f} cells")
 print(f"  Max catchment: {max_acc * dem_transform[0]**2 / 1e6:.1f} km2")
@@ -122,40 +217,53 @@ print(f"  Cells > 10000: {(acc_data > 10000).sum()}")
 print("\n5. Extracting stream network + Strahler ordering...")
 
 STREAM_THRESHOLD = 500  # cells (~0.45 km2 catchment at 30m)
-STREAMS_RASTER = os.path.join(DATA_DIR, 'streams_wbt.tif')
+STREAMS_RASTER = os.path.join(SCRATCH_DIR, 'streams_wbt.tif')
 STRAHLER_RASTER = os.path.join(DATA_DIR, 'strahler_wbt.tif')
-STREAMS_VECTOR = os.path.join(DATA_DIR, 'streams_wbt.shp')
+STREAMS_VECTOR = os.path.join(SCRATCH_DIR, 'streams_wbt.shp')
 
 # Extract streams
 wbt.extract_streams(ACC_FILE, STREAMS_RASTER, threshold=STREAM_THRESHOLD)
 
-# Compute Strahler stream order
-wbt.strahler_stream_order(FDIR_FILE, STREAMS_RASTER, STRAHLER_RASTER)
-
-# Vectorize streams (WhiteboxTools traces flow paths properly)
-wbt.raster_streams_to_vector(STREAMS_RASTER, FDIR_FILE, STREAMS_VECTOR)
+# Strahler order and vectorizing (WhiteboxTools traces flow paths properly)
+# both only read the stream and pointer rasters, so run the two WBT
+# processes side by side
+with ThreadPoolExecutor(max_workers=2) as ex:
+    strahler_job = ex.submit(wbt.strahler_stream_order, FDIR_FILE, STREAMS_RASTER, STRAHLER_RASTER)
+    vector_job = ex.submit(wbt.raster_streams_to_vector, STREAMS_RASTER, FDIR_FILE, STREAMS_VECTOR)
+    strahler_job.result()
+    vector_job.result()
 
 # Load vectorized streams
-streams_gdf = gpd.read_file(STREAMS_VECTOR)
+streams_gdf = gpd.read_file(STREAMS_VECTOR, engine='pyogrio')
 streams_gdf = streams_gdf.set_crs(dem_crs, allow_override=True)
 
 print(f"  Total stream segments: {len(streams_gdf)}")
 print(f"  Total stream length: {streams_gdf.geometry.length.sum()/1000:.1f} km")
 
+def world_to_rowcol(transform, xy):
+    """Row/col indices of (N, 2) world coordinates (floored, like rasterio rowcol).
+
+    The affine is inverted once and applied to all points as array arithmetic.
+    """
+    inv = ~transform
+    cols = np.floor(inv.a * xy[:, 0] + inv.b * xy[:, 1] + inv.c).astype(int)
+    rows = np.floor(inv.d * xy[:, 0] + inv.e * xy[:, 1] + inv.f).astype(int)
+    return rows, cols
+
 # Join Strahler order: sample the raster at each stream's midpoint
 with rasterio.open(STRAHLER_RASTER) as src:
     strahler_data = src.read(1)
     strahler_transform = src.transform
 
-orders = []
-for idx, row in streams_gdf.iterrows():
-    coords = list(row.geometry.coords)
-    mid = coords[len(coords)//2]
-    r, c = rowcol(strahler_transform, mid[0], mid[1])
-    if 0 <= r < strahler_data.shape[0] and 0 <= c < strahler_data.shape[1]:
-        orders.append(int(strahler_data[r, c]))
-    else:
-        orders.append(0)
+# Middle vertex of every line, picked from one flat coordinate array
+n_coords = shapely.get_num_coordinates(streams_gdf.geometry.values)
+mids = shapely.get_coordinates(streams_gdf.geometry.values)[np.cumsum(n_coords) - n_coords + n_coords // 2]
+
+rows, cols = world_to_rowcol(strahler_transform, mids)
+in_bounds = (rows >= 0) & (rows < strahler_data.shape[0]) & (cols >= 0) & (cols < strahler_data.shape[1])
+
+orders = np.zeros(len(streams_gdf), dtype=int)
+orders[in_bounds] = strahler_data[rows[in_bounds], cols[in_bounds]]
 
 streams_gdf['stream_order'] = orders
 streams_gdf['length_m'] = streams_gdf.geometry.length
@@ -200,12 +308,12 @@ print("\n8. Saving stream network...")
 
 # Save in UTM 43N
 streams_utm_path = os.path.join(LAYERS_DIR, 'streams_order3plus_utm43n.geojson')
-streams_filtered.to_file(streams_utm_path, driver='GeoJSON')
+streams_filtered.to_file(streams_utm_path, driver='GeoJSON', engine='pyogrio')
 
 # Save in WGS84 for web display
 streams_wgs84 = streams_filtered.to_crs('EPSG:4326')
 streams_wgs84_path = os.path.join(LAYERS_DIR, 'streams_order3plus_wgs84.geojson')
-streams_wgs84.to_file(streams_wgs84_path, driver='GeoJSON')
+streams_wgs84.to_file(streams_wgs84_path, driver='GeoJSON', engine='pyogrio')
 
 print(f"  UTM: {streams_utm_path}")
 print(f"  WGS84: {streams_wgs84_path}")
@@ -217,26 +325,21 @@ print("\n9. Watershed delineation...")
 
 # Use WhiteboxTools watershed delineation
 # Pour points = endpoints of Order 4+ streams
-pour_points = []
-high_order_streams = streams_filtered[streams_filtered['stream_order'] >= 4]
-
-for idx, stream in high_order_streams.iterrows():
-    coords = list(stream.geometry.coords)
-    if coords:
-        end_point = Point(coords[-1])
-        pour_points.append({
-            'geometry': end_point,
-            'stream_id': stream['stream_id'],
-            'stream_order': stream['stream_order']
-        })
-
-if pour_points:
-    pour_gdf = gpd.GeoDataFrame(pour_points, crs=dem_crs)
-    pour_shp = os.path.join(DATA_DIR, 'pour_points.shp')
-    pour_gdf.to_file(pour_shp)
+high_order_streams = streams_filtered[
+    (streams_filtered['stream_order'] >= 4) & ~streams_filtered.geometry.is_empty
+]
+pour_gdf = gpd.GeoDataFrame(
+    high_order_streams[['stream_id', 'stream_order']].reset_index(drop=True),
+    geometry=shapely.get_point(high_order_streams.geometry.values, -1),
+    crs=dem_crs
+)
+
+if len(pour_gdf):
+    pour_shp = os.path.join(SCRATCH_DIR, 'pour_points.shp')
+    pour_gdf.to_file(pour_shp, engine='pyogrio')
 
     # Use WhiteboxTools watershed tool
-    watershed_raster = os.path.join(DATA_DIR, 'watersheds_wbt.tif')
+    watershed_raster = os.path.join(SCRATCH_DIR, 'watersheds_wbt.tif')
     try:
         wbt.watershed(FDIR_FILE, pour_shp, watershed_raster)
 
@@ -245,27 +348,28 @@ if pour_points:
             ws_data = src.read(1)
             ws_transform = src.transform
 
-        watersheds_list = []
-        for geom, value in rio_shapes(ws_data, mask=(ws_data > 0), transform=ws_transform):
-            poly = shape(geom)
-            if poly.is_valid and poly.area > 100000:  # > 0.1 km2
-                watersheds_list.append({
-                    'geometry': poly,
-                    'watershed_id': int(value),
-                    'area_m2': poly.area,
-                    'area_km2': poly.area / 1e6
-                })
-
-        if watersheds_list:
-            watersheds_gdf = gpd.GeoDataFrame(watersheds_list, crs=dem_crs)
+        # One polygonize pass over the labelled raster for every watershed,
+        # then validity and area for all of them in vectorized shapely calls
+        ws_shapes = list(rio_shapes(ws_data, mask=(ws_data > 0), transform=ws_transform))
+        ws_polys = np.array([shape(geom) for geom, _ in ws_shapes], dtype=object)
+        ws_ids = np.array([int(value) for _, value in ws_shapes], dtype=np.int64)
+        ws_areas = shapely.area(ws_polys)
+        ws_keep = shapely.is_valid(ws_polys) & (ws_areas > 100000)  # > 0.1 km2
+
+        if ws_keep.any():
+            watersheds_gdf = gpd.GeoDataFrame({
+                'watershed_id': ws_ids[ws_keep],
+                'area_m2': ws_areas[ws_keep],
+                'area_km2': ws_areas[ws_keep] / 1e6
+            }, geometry=ws_polys[ws_keep], crs=dem_crs)
 
             # Save watersheds
             ws_utm_path = os.path.join(LAYERS_DIR, 'watersheds_utm43n.geojson')
-            watersheds_gdf.to_file(ws_utm_path, driver='GeoJSON')
+            watersheds_gdf.to_file(ws_utm_path, driver='GeoJSON', engine='pyogrio')
 
             ws_wgs84 = watersheds_gdf.to_crs('EPSG:4326')
             ws_wgs84_path = os.path.join(LAYERS_DIR, 'watersheds_wgs84.geojson')
-            ws_wgs84.to_file(ws_wgs84_path, driver='GeoJSON')
+            ws_wgs84.to_file(ws_wgs84_path, driver='GeoJSON', engine='pyogrio')
 
             print(f"  {len(watersheds_gdf)} watersheds delineated")
             print(f"  Total watershed area: {watersheds_gdf['area_km2'].sum():.1f} km2")
@@ -277,9 +381,8 @@ if pour_points:
 
         # Fallback: use rasterio shapes on flow accumulation to get catchment areas
         watersheds_list = []
-        for idx, pp in pour_gdf.iterrows():
-            x, y = pp.geometry.x, pp.geometry.y
-            r, c = rowcol(dem_transform, x, y)
+        pour_rows, pour_cols = world_to_rowcol(dem_transform, shapely.get_coordinates(pour_gdf.geometry.values))
+        for idx, (r, c) in enumerate(zip(pour_rows, pour_cols)):
             if 0 <= r < acc_data.shape[0] and 0 <= c < acc_data.shape[1]:
                 # Use accumulation-based catchment approximation
                 threshold = acc_data[r, c] * 0.5
@@ -287,8 +390,11 @@ if pour_points:
                 labeled, n = ndimage.label(catch_mask)
                 label_at_point = labeled[r, c]
                 if label_at_point > 0:
-                    single_mask = (labeled == label_at_point).astype(np.uint8)
-                    for geom, val in rio_shapes(single_mask, mask=single_mask.astype(bool), transform=dem_transform):
+                    # Polygonize only the catchment's bounding box, not the full raster
+                    rows, cols = ndimage.find_objects(labeled, max_label=label_at_point)[label_at_point - 1]
+                    single_mask = (labeled[rows, cols] == label_at_point).astype(np.uint8)
+                    bbox_transform = dem_transform * Affine.translation(cols.start, rows.start)
+                    for geom, val in rio_shapes(single_mask, mask=single_mask.astype(bool), transform=bbox_transform):
                         poly = shape(geom)
                         if poly.is_valid and poly.area > 100000:
                             watersheds_list.append({
@@ -301,10 +407,10 @@ if pour_points:
         if watersheds_list:
             watersheds_gdf = gpd.GeoDataFrame(watersheds_list, crs=dem_crs)
             ws_utm_path = os.path.join(LAYERS_DIR, 'watersheds_utm43n.geojson')
-            watersheds_gdf.to_file(ws_utm_path, driver='GeoJSON')
+            watersheds_gdf.to_file(ws_utm_path, driver='GeoJSON', engine='pyogrio')
             ws_wgs84 = watersheds_gdf.to_crs('EPSG:4326')
             ws_wgs84_path = os.path.join(LAYERS_DIR, 'watersheds_wgs84.geojson')
-            ws_wgs84.to_file(ws_wgs84_path, driver='GeoJSON')
+            ws_wgs84.to_file(ws_wgs84_path, driver='GeoJSON', engine='pyogrio')
             print(f"  {len(watersheds_gdf)} fallback watersheds created")
 else:
     print("  No high-order pour points found for watershed delineation")
@@ -314,42 +420,105 @@ else:
 # ====================================================================
 print("\n10. Computing Topographic Wetness Index...")
 
-# Compute slope from breached DEM
-with rasterio.open(DEM_BREACHED) as src:
-    dem_arr = src.read(1).astype(np.float64)
-dem_arr[dem_arr == NODATA_VAL] = np.nan
-
-dy, dx = np.gradient(dem_arr, abs(dem_transform[4]), dem_transform[0])
-slope = np.degrees(np.arctan(np.sqrt(dx**2 + dy**2)))
-print(f"  Slope range: {np.nanmin(slope):.2f} to {np.nanmax(slope):.2f} degrees")
-
-# TWI = ln(a / tan(slope))
-slope_rad = np.deg2rad(slope)
-slope_tan = np.tan(slope_rad)
-slope_tan[slope_tan < 0.001] = 0.001
-
-# Use WhiteboxTools accumulation (already in cells, convert to area)
+# Slope and TWI are written block by block into tiled GeoTIFFs, so only one
+# 512x512 DEM block (plus a 1-cell halo for the gradient) is held at a time
+TWI_BLOCK = 512
+TWI_OVERVIEWS = [2, 4, 8, 16]
 cell_area = dem_transform[0] * abs(dem_transform[4])  # m2
-sca = acc_data * cell_area / dem_transform[0]  # specific catchment area (m)
 
-twi = np.log(sca / slope_tan)
-twi[np.isnan(dem_arr)] = np.nan
+# Specific catchment area = cells * cell_area / contour width (dx), which
+# reduces to cells * dy: one scalar per pixel
+sca_scale = abs(dem_transform[4])
 
-# Save TWI
 twi_path = os.path.join(DATA_DIR, 'twi_utm43n.tif')
-with rasterio.open(DEM_FIXED) as src:
-    twi_profile = src.profile.copy()
-twi_profile.update(dtype='float64', nodata=np.nan)
-with rasterio.open(twi_path, 'w', **twi_profile) as dst:
-    dst.write(twi, 1)
-
-print(f"  TWI range: {np.nanmin(twi):.1f} to {np.nanmax(twi):.1f}")
-print(f"  TWI saved: {twi_path}")
-
-# Also save slope for flood risk analysis
 slope_path = os.path.join(DATA_DIR, 'slope_utm43n.tif')
-with rasterio.open(slope_path, 'w', **twi_profile) as dst:
-    dst.write(slope, 1)
+twi_profile = profile.copy()
+twi_profile.update(dtype='float32', nodata=np.nan, tiled=True,
+                   blockxsize=TWI_BLOCK, blockysize=TWI_BLOCK, compress='deflate',
+                   predictor=3, bigtiff='IF_SAFER', num_threads='all_cpus')
+
+n_rows, n_cols = dem_shape
+
+
+@njit(nogil=True, cache=True)
+def twi_kernel(dem, acc, row_off, col_off, sca_scale, dy_res, dx_res):
+    """Slope (degrees) and TWI for one block in a single pass.
+
+    dem is the block plus its halo, with the block starting at
+    (row_off, col_off); acc is the block's accumulation in cells, which
+    sca_scale turns into specific catchment area (m). Slope
+    matches np.gradient (central differences inside, one-sided at the array
+    edge) and tan(slope) is floored at 0.001. NaN elevations propagate to
+    their neighbours, and nodata accumulation gives a NaN TWI.
+    """
+    H, W = acc.shape
+    DH, DW = dem.shape
+    twi = np.empty((H, W), dtype=np.float32)
+    slope = np.empty((H, W), dtype=np.float32)
+    for i in range(H):
+        di = i + row_off
+        i0 = max(di - 1, 0)
+        i1 = min(di + 1, DH - 1)
+        for j in range(W):
+            dj = j + col_off
+            j0 = max(dj - 1, 0)
+            j1 = min(dj + 1, DW - 1)
+            dzdx = (dem[di, j1] - dem[di, j0]) / ((j1 - j0) * dx_res)
+            dzdy = (dem[i1, dj] - dem[i0, dj]) / ((i1 - i0) * dy_res)
+            s = math.sqrt(dzdx * dzdx + dzdy * dzdy)
+            slope[i, j] = math.degrees(math.atan(s))
+            # TWI = ln(a / tan(slope)), with tan(slope) taken straight from the gradient
+            if s < 0.001:
+                s = 0.001
+            twi[i, j] = math.log(acc[i, j] * sca_scale / s)
+    return twi, slope
+
+
+def twi_block(win):
+    """Slope (degrees) and TWI for one output block; returns (twi, slope)."""
+    # Block grown by one cell on each side, clipped at the raster edge
+    # (where the gradient falls back to one-sided differences, exactly as
+    # np.gradient does on the full array)
+    r0, c0 = max(win.row_off - 1, 0), max(win.col_off - 1, 0)
+    r1 = min(win.row_off + win.height + 1, n_rows)
+    c1 = min(win.col_off + win.width + 1, n_cols)
+
+    # float32 is ample for elevations in metres; one handle per block, as
+    # rasterio datasets must not be shared between threads
+    with rasterio.open(DEM_BREACHED) as src:
+        dem_arr = src.read(1, window=Window(c0, r0, c1 - c0, r1 - r0), out_dtype=np.float32)
+    dem_arr[dem_arr == NODATA_VAL] = np.nan
+
+    acc_block = acc_data[win.row_off:win.row_off + win.height,
+                         win.col_off:win.col_off + win.width]
+    return twi_kernel(dem_arr, acc_block, win.row_off - r0, win.col_off - c0,
+                      sca_scale, abs(dem_transform[4]), dem_transform[0])
+
+
+# Blocks are independent and twi_kernel/GDAL release the GIL, so threads
+# compute them side by side; writes stay in this thread, in block order
+twi_min, twi_max = np.inf, -np.inf
+slope_min, slope_max = np.inf, -np.inf
+with rasterio.open(twi_path, 'w', **twi_profile) as twi_dst, \
+        rasterio.open(slope_path, 'w', **twi_profile) as slope_dst, \
+        ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+    windows = [win for _, win in twi_dst.block_windows(1)]
+    for win, (twi, slope) in zip(windows, ex.map(twi_block, windows)):
+        twi_dst.write(twi, 1, window=win)
+        slope_dst.write(slope, 1, window=win)
+
+        if not np.isnan(slope).all():
+            twi_min, twi_max = min(twi_min, np.nanmin(twi)), max(twi_max, np.nanmax(twi))
+            slope_min, slope_max = min(slope_min, np.nanmin(slope)), max(slope_max, np.nanmax(slope))
+
+    # Averaged overviews, so map previews can read a reduced level
+    for dst in (twi_dst, slope_dst):
+        dst.build_overviews(TWI_OVERVIEWS, Resampling.average)
+        dst.update_tags(ns='rio_overview', resampling='average')
+
+print(f"  Slope range: {slope_min:.2f} to {slope_max:.2f} degrees")
+print(f"  TWI range: {twi_min:.1f} to {twi_max:.1f}")
+print(f"  TWI saved: {twi_path}")
 print(f"  Slope saved: {slope_path}")
 
 # ====================================================================
@@ -359,7 +528,7 @@ print("\n" + "="*70)
 print("PROCESSING COMPLETE - SUMMARY")
 print("="*70)
 
-print(f"DEM: {data.shape[0]} x {data.shape[1]} pixels ({data.shape[0]*30/1000:.0f} x {data.shape[1]*30/1000:.0f} km)")
+print(f"DEM: {dem_shape[0]} x {dem_shape[1]} pixels ({dem_shape[0]*30/1000:.0f} x {dem_shape[1]*30/1000:.0f} km)")
 print(f"Max flow accumulation: {max_acc:.0f} cells ({max_acc * cell_area / 1e6:.1f} km2)")
 print(f"Total streams: {len(streams_gdf)} segments, {streams_gdf.geometry.length.sum()/1000:.1f} km")
 print(f"Order 3+ streams: {len(streams_filtered)} segments, {streams_filtered.geometry.length.sum()/1000:.1f} km")
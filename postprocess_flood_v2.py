@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+SAR Flood Post-processing v2: vectorize the downloaded Sentinel-1 flood mask
+Cleans the GEE flood mask with a 3x3 morphological opening (drops speckle
+and one-pixel slivers) and polygonizes it locally with rasterio, replacing
+the server-side reduceToVectors
+Run after gee_flood_sar_v2.py
+"""
+
+import os
+import numpy as np
+import rasterio
+import geopandas as gpd
+from rasterio.features import shapes
+from scipy import ndimage
+from shapely.geometry import shape
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data-v2')
+LAYERS_DIR = os.path.join(BASE_DIR, 'layers-v2')
+FLOOD_MASK_FILE = os.path.join(DATA_DIR, 'sar_flood_mask.tif')
+DIFF_FILE = os.path.join(DATA_DIR, 'backscatter_difference.tif')
+SAR_FLOOD_FILE = os.path.join(LAYERS_DIR, 'sar_flood_full_utm43n.geojson')
+
+MIN_AREA_SQM = 1000
+EIGHT_CONNECTED = np.ones((3, 3), dtype=bool)
+
+print("="*60)
+print("SAR FLOOD POST-PROCESSING (v2)")
+print("="*60)
+
+# 1. Load Rasters
+print("\n1. Loading flood mask and backscatter difference...")
+
+with rasterio.open(FLOOD_MASK_FILE) as src:
+    flood_mask = src.read(1) == 1
+    transform = src.transform
+    crs = src.crs
+    detection_year = int(src.tags()['detection_year'])
+
+with rasterio.open(DIFF_FILE) as src:
+    backscatter_diff = src.read(1)
+
+# Both rasters are exported over the same region, scale and CRS
+if backscatter_diff.shape != flood_mask.shape:
+    print(f"✗ Grid mismatch: mask {flood_mask.shape} vs difference {backscatter_diff.shape}")
+    exit(1)
+
+pixel_area = abs(transform.a * transform.e)
+print(f"✓ {flood_mask.shape[1]} x {flood_mask.shape[0]} pixels at {abs(transform.a):.0f}m")
+print(f"  Flooded pixels: {flood_mask.sum():,} ({detection_year} monsoon)")
+
+# 2. Morphological Opening
+print("\n2. Opening flood mask (3x3)...")
+
+opened = ndimage.binary_opening(flood_mask, structure=EIGHT_CONNECTED)
+print(f"✓ Removed {flood_mask.sum() - opened.sum():,} speckle pixels")
+
+# 3. Label Flood Patches
+print("\n3. Labelling flood patches...")
+
+# 8-connected, matching reduceToVectors(eightConnected=True)
+labels, n_patches = ndimage.label(opened, structure=EIGHT_CONNECTED)
+patch_ids = np.arange(1, n_patches + 1)
+
+patch_area = ndimage.sum(opened, labels, patch_ids) * pixel_area
+patch_intensity = ndimage.mean(backscatter_diff, labels, patch_ids)
+
+# Drop small patches before polygonizing
+keep = patch_area >= MIN_AREA_SQM
+lookup = np.zeros(n_patches + 1, dtype=np.int32)
+lookup[1:][keep] = patch_ids[keep]
+labels = lookup[labels]
+print(f"✓ {n_patches} patches, {keep.sum()} ≥ {MIN_AREA_SQM} m²")
+
+# 4. Polygonize
+print("\n4. Polygonizing flood patches...")
+
+records = [
+    {'patch_id': int(value), 'geometry': shape(geom)}
+    for geom, value in shapes(labels, mask=labels > 0, connectivity=8, transform=transform)
+]
+flood_gdf = gpd.GeoDataFrame(records, geometry='geometry', crs=crs)
+
+# Attributes (mask is in UTM 43N, so areas are in metres)
+flood_gdf['flood_intensity_db'] = patch_intensity[flood_gdf['patch_id'] - 1]
+flood_gdf['area_sqm'] = flood_gdf.geometry.area
+flood_gdf['area_hectares'] = flood_gdf['area_sqm'] / 10000
+flood_gdf['flood_category'] = np.select(
+    [flood_gdf['flood_intensity_db'] > 6, flood_gdf['flood_intensity_db'] > 4],
+    ['high', 'moderate'], 'low'
+)
+flood_gdf['detection_year'] = detection_year
+flood_gdf['data_source'] = 'Sentinel-1_VH'
+flood_gdf = flood_gdf.drop(columns='patch_id')
+
+os.makedirs(LAYERS_DIR, exist_ok=True)
+flood_gdf.to_crs('EPSG:4326').to_file(SAR_FLOOD_FILE, driver='GeoJSON', engine='pyogrio')
+print(f"✓ Saved {len(flood_gdf)} flood polygons: {SAR_FLOOD_FILE}")
+
+# Print summary
+print("\n" + "="*60)
+print("SAR FLOOD POST-PROCESSING COMPLETE (v2)")
+print("="*60)
+print(f"Flood area: {flood_gdf['area_hectares'].sum():,.1f} ha")
+for category in ['high', 'moderate', 'low']:
+    subset = flood_gdf[flood_gdf['flood_category'] == category]
+    print(f"  {category}: {len(subset)} polygons, {subset['area_hectares'].sum():,.1f} ha")
@@ -9,9 +9,17 @@ import os
 import geopandas as gpd
 import pandas as pd
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import simplekml
 
+# GeoParquet cache of the WGS84 layers (skipped without pyarrow)
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_CACHE = True
+except ImportError:
+    PARQUET_CACHE = False
+
 print("\n" + "="*70)
 print("LAYER PREPARATION v2 (Final Processing)")
 print("="*70)
@@ -26,7 +34,7 @@ EXPORTS_DIR.mkdir(exist_ok=True)
 
 # Load UIT boundaries
 BOUNDARIES_FILE = BASE_DIR / 'boundaries.geojson'
-boundaries = gpd.read_file(BOUNDARIES_FILE)
+boundaries = gpd.read_file(BOUNDARIES_FILE, engine='pyogrio')
 if boundaries.crs != 'EPSG:4326':
     boundaries_wgs84 = boundaries.to_crs('EPSG:4326')
 else:
@@ -80,19 +88,32 @@ for layer_name, files in layer_files.items():
     print(f"\n  Loading {layer_name}...")
     
     if utm_file.exists():
-        utm_gdf = gpd.read_file(utm_file)
+        utm_gdf = gpd.read_file(utm_file, engine='pyogrio')
         print(f"    ✓ UTM version: {len(utm_gdf)} features")
         
-        # Create WGS84 version if needed
-        if wgs84_file is None or not wgs84_file.exists():
-            wgs84_gdf = utm_gdf.to_crs('EPSG:4326')
-            if wgs84_file is None:
-                wgs84_file = LAYERS_DIR / f'{layer_name}_wgs84.geojson'
-            wgs84_gdf.to_file(wgs84_file, driver='GeoJSON')
-            print(f"    ✓ Created WGS84 version: {wgs84_file}")
+        # Create WGS84 version if missing or older than the UTM layer; the
+        # GeoJSON stays the published copy, the GeoParquet one is what
+        # repeat runs read back
+        if wgs84_file is None:
+            wgs84_file = LAYERS_DIR / f'{layer_name}_wgs84.geojson'
+        cache_file = LAYERS_DIR / f'{layer_name}_wgs84.parquet'
+        utm_mtime = utm_file.stat().st_mtime
+        if PARQUET_CACHE and cache_file.exists() and cache_file.stat().st_mtime >= utm_mtime:
+            wgs84_gdf = gpd.read_parquet(cache_file)
+            print(f"    ✓ WGS84 version (cached): {len(wgs84_gdf)} features")
         else:
-            wgs84_gdf = gpd.read_file(wgs84_file)
-            print(f"    ✓ WGS84 version: {len(wgs84_gdf)} features")
+            if wgs84_file.exists() and wgs84_file.stat().st_mtime >= utm_mtime:
+                wgs84_gdf = gpd.read_file(wgs84_file, engine='pyogrio')
+                print(f"    ✓ WGS84 version: {len(wgs84_gdf)} features")
+            else:
+                wgs84_gdf = utm_gdf.to_crs('EPSG:4326')
+                wgs84_gdf.to_file(wgs84_file, driver='GeoJSON', engine='pyogrio')
+                print(f"    ✓ Created WGS84 version: {wgs84_file}")
+            if PARQUET_CACHE:
+                wgs84_gdf.to_parquet(cache_file)
+        
+        # Repair geometries once here rather than per polygon in the stats loop
+        utm_gdf['geometry'] = utm_gdf.geometry.make_valid()
         
         loaded_layers[layer_name] = {
             'utm': utm_gdf,
@@ -110,95 +131,119 @@ print("\n2. Generating per-polygon statistics...")
 # Prepare boundaries in UTM for accurate area calculations
 boundaries_utm = boundaries.to_crs('EPSG:32643') if boundaries.crs != 'EPSG:32643' else boundaries
 
-polygon_stats = []
+stats_df = pd.DataFrame({
+    'polygon_id': boundaries_utm.index,
+    'polygon_name': boundaries_utm.get('name', pd.Series(
+        [f'UIT-{idx}' for idx in boundaries_utm.index], index=boundaries_utm.index
+    )).str.strip(),
+    'layer_type': boundaries_utm.get('layer', 'Unknown'),
+    'area_km2': boundaries_utm.geometry.area / 1e6
+}, index=boundaries_utm.index)
+
+# One overlay per layer against all polygons at once (tagged with their
+# polygon_id); the per-polygon stats are then groupby reductions
+poly_ids = gpd.GeoDataFrame(
+    {'polygon_id': boundaries_utm.index},
+    geometry=boundaries_utm.geometry.make_valid().values,
+    crs='EPSG:32643'
+)
+poly_bounds = poly_ids.bounds.to_numpy()
+
+
+def per_polygon(values, intersected):
+    """Sum values over each polygon's features (0 where it has none)."""
+    return values.groupby(intersected['polygon_id']).sum().reindex(stats_df.index, fill_value=0)
+
+
+def per_polygon_counts(intersected, column, categories):
+    """Feature counts per polygon for each category of column."""
+    counts = intersected.groupby(['polygon_id', column]).size().unstack(fill_value=0)
+    return counts.reindex(index=stats_df.index, columns=categories, fill_value=0)
+
+
+def layer_stats(layer_name, utm_gdf):
+    """(features intersected, per-polygon stats columns) for one layer; (0, None) if the overlay fails."""
+    # Use UTM version for accurate area calculations, ensure CRS match
+    if utm_gdf.crs is None or str(utm_gdf.crs) != 'EPSG:32643':
+        utm_gdf = utm_gdf.to_crs('EPSG:32643')
+
+    # Cheap bounding-box test first: features whose box misses every
+    # polygon's box cannot intersect any polygon, so they skip the overlay
+    fb = utm_gdf.bounds.to_numpy()[:, None, :]
+    near = ((fb[..., 0] <= poly_bounds[:, 2]) & (fb[..., 2] >= poly_bounds[:, 0]) &
+            (fb[..., 1] <= poly_bounds[:, 3]) & (fb[..., 3] >= poly_bounds[:, 1])).any(axis=1)
+    utm_gdf = utm_gdf[near]
+
+    try:
+        intersected = utm_gdf.overlay(poly_ids, how='intersection')
+    except Exception as e:
+        print(f"  ⚠ Overlay failed for {layer_name}: {e}")
+        return 0, None
+
+    layer_df = pd.DataFrame(index=stats_df.index)
+    count = intersected.groupby('polygon_id').size().reindex(stats_df.index, fill_value=0)
+
+    if layer_name == 'streams':
+        layer_df[f'{layer_name}_count'] = count
+        layer_df[f'{layer_name}_length_km'] = (per_polygon(intersected.geometry.length, intersected) / 1000).round(2)
+
+        # Count by stream order
+        if 'stream_order' in intersected.columns:
+            order_counts = per_polygon_counts(intersected, 'stream_order', [3, 4, 5, 6])
+            for order in [3, 4, 5, 6]:
+                layer_df[f'streams_order{order}_count'] = order_counts[order]
+
+    elif layer_name == 'water_bodies':
+        layer_df[f'{layer_name}_count'] = count
+        if 'area_sqm' in intersected.columns:
+            layer_df[f'{layer_name}_area_ha'] = (per_polygon(intersected['area_sqm'], intersected) / 10000).round(2)
+
+        # Count by water type
+        if 'water_type' in intersected.columns:
+            wtypes = ['permanent_jrc', 'seasonal_jrc', 'post_monsoon_s2']
+            type_counts = per_polygon_counts(intersected, 'water_type', wtypes)
+            for wtype in wtypes:
+                key = wtype.replace('_jrc', '').replace('_s2', '')
+                layer_df[f'water_{key}_count'] = type_counts[wtype]
+
+    elif layer_name == 'flood_risk':
+        layer_df[f'{layer_name}_zones'] = count
+        if 'area_hectares' in intersected.columns:
+            layer_df[f'{layer_name}_area_ha'] = per_polygon(intersected['area_hectares'], intersected).round(2)
+
+        # Count by risk level
+        if 'risk_label' in intersected.columns:
+            risk_counts = per_polygon_counts(intersected, 'risk_label', ['high', 'medium', 'low'])
+            for risk in ['high', 'medium', 'low']:
+                layer_df[f'flood_risk_{risk}_zones'] = risk_counts[risk]
+
+    elif layer_name == 'watersheds':
+        layer_df[f'{layer_name}_count'] = count
+        if 'area_km2' in intersected.columns:
+            layer_df[f'{layer_name}_area_km2'] = per_polygon(intersected['area_km2'], intersected).round(2)
 
-for idx, polygon in boundaries_utm.iterrows():
-    stats = {
-        'polygon_id': idx,
-        'polygon_name': polygon.get('name', f'UIT-{idx}').strip(),
-        'layer_type': polygon.get('layer', 'Unknown'),
-        'area_km2': polygon.geometry.area / 1e6
-    }
-    
-    print(f"  Processing polygon {idx}: {stats['polygon_name']}")
-    
-    # Statistics for each layer
-    for layer_name, layer_data in loaded_layers.items():
-        # Use UTM version for accurate area calculations, ensure CRS match
-        utm_gdf = layer_data['utm'].copy()
-        if utm_gdf.crs is None or str(utm_gdf.crs) != 'EPSG:32643':
-            utm_gdf = utm_gdf.to_crs('EPSG:32643')
-
-        if not utm_gdf.empty:
-            # Validate geometries before overlay
-            utm_valid = utm_gdf.copy()
-            utm_valid['geometry'] = utm_valid.geometry.make_valid()
-            poly_gdf = gpd.GeoDataFrame([polygon], crs='EPSG:32643')
-            poly_gdf['geometry'] = poly_gdf.geometry.make_valid()
-
-            # Intersect with polygon
-            try:
-                intersected = utm_valid.overlay(
-                    poly_gdf,
-                    how='intersection'
-                )
-            except Exception as e:
-                print(f"    ⚠ Overlay failed for {layer_name}: {e}")
-                continue
-            
-            if layer_name == 'streams':
-                total_length = intersected.geometry.length.sum() / 1000  # km
-                stats[f'{layer_name}_count'] = len(intersected)
-                stats[f'{layer_name}_length_km'] = round(total_length, 2)
-                
-                # Count by stream order
-                if 'stream_order' in intersected.columns:
-                    order_counts = intersected['stream_order'].value_counts()
-                    for order in [3, 4, 5, 6]:
-                        stats[f'streams_order{order}_count'] = order_counts.get(order, 0)
-            
-            elif layer_name == 'water_bodies':
-                stats[f'{layer_name}_count'] = len(intersected)
-                if 'area_sqm' in intersected.columns:
-                    total_area = intersected['area_sqm'].sum() / 10000  # hectares
-                    stats[f'{layer_name}_area_ha'] = round(total_area, 2)
-                
-                # Count by water type
-                if 'water_type' in intersected.columns:
-                    type_counts = intersected['water_type'].value_counts()
-                    for wtype in ['permanent_jrc', 'seasonal_jrc', 'post_monsoon_s2']:
-                        key = wtype.replace('_jrc', '').replace('_s2', '')
-                        stats[f'water_{key}_count'] = type_counts.get(wtype, 0)
-            
-            elif layer_name == 'flood_risk':
-                stats[f'{layer_name}_zones'] = len(intersected)
-                if 'area_hectares' in intersected.columns:
-                    total_area = intersected['area_hectares'].sum()
-                    stats[f'{layer_name}_area_ha'] = round(total_area, 2)
-                
-                # Count by risk level
-                if 'risk_label' in intersected.columns:
-                    risk_counts = intersected['risk_label'].value_counts()
-                    for risk in ['high', 'medium', 'low']:
-                        stats[f'flood_risk_{risk}_zones'] = risk_counts.get(risk, 0)
-            
-            elif layer_name == 'watersheds':
-                stats[f'{layer_name}_count'] = len(intersected)
-                if 'area_km2' in intersected.columns:
-                    total_area = intersected['area_km2'].sum()
-                    stats[f'{layer_name}_area_km2'] = round(total_area, 2)
-                    
-            else:
-                # Generic count for other layers
-                stats[f'{layer_name}_count'] = len(intersected)
-                if len(intersected) > 0 and 'area_hectares' in intersected.columns:
-                    total_area = intersected['area_hectares'].sum()
-                    stats[f'{layer_name}_area_ha'] = round(total_area, 2)
-    
-    polygon_stats.append(stats)
+    else:
+        # Generic count for other layers (area left blank where a polygon has none)
+        layer_df[f'{layer_name}_count'] = count
+        if len(intersected) > 0 and 'area_hectares' in intersected.columns:
+            area = per_polygon(intersected['area_hectares'], intersected).round(2)
+            layer_df[f'{layer_name}_area_ha'] = area.where(count > 0)
 
-# Convert to DataFrame
-stats_df = pd.DataFrame(polygon_stats)
+    return len(intersected), layer_df
+
+
+# Layers are independent and the GEOS work in overlay releases the GIL, so
+# the per-layer overlays run side by side; columns are joined in layer order
+stat_layers = [name for name, data in loaded_layers.items() if not data['utm'].empty]
+with ThreadPoolExecutor(max_workers=max(len(stat_layers), 1)) as ex:
+    layer_results = list(ex.map(layer_stats, stat_layers, [loaded_layers[name]['utm'] for name in stat_layers]))
+
+layer_frames = []
+for layer_name, (n_intersected, layer_df) in zip(stat_layers, layer_results):
+    if layer_df is not None:
+        print(f"  {layer_name}: {n_intersected} features intersect the UIT polygons")
+        layer_frames.append(layer_df)
+stats_df = pd.concat([stats_df] + layer_frames, axis=1)
 
 # Save statistics
 stats_csv_path = EXPORTS_DIR / 'drainage_summary_full.csv'
@@ -215,21 +260,42 @@ for col in ['streams_length_km', 'water_bodies_area_ha', 'flood_risk_area_ha']:
 # 3. CREATE KML EXPORT
 print("\n3. Creating Google Earth KML export...")
 
+# ~10 m at Dausa's latitude, a third of the 30 m DEM cell the layers come from
+KML_SIMPLIFY_DEG = 0.0001
+
 kml = simplekml.Kml()
 
+# Placemarks with the same look share one Style (written once per folder
+# and referenced by styleUrl) instead of each carrying its own copy
+kml_styles = {}
+
+
+def shared_style(line_color, line_width=None, fill_color=None):
+    """Cached simplekml Style for a line colour/width and optional fill."""
+    key = (line_color, line_width, fill_color)
+    if key not in kml_styles:
+        style = simplekml.Style()
+        style.linestyle.color = line_color
+        if line_width is not None:
+            style.linestyle.width = line_width
+        if fill_color is not None:
+            style.polystyle.color = fill_color
+        kml_styles[key] = style
+    return kml_styles[key]
+
+
 # Add UIT boundaries
 boundary_folder = kml.newfolder(name="UIT Boundaries")
-for idx, polygon in boundaries_wgs84.iterrows():
-    name = polygon.get('name', f'UIT-{idx}').strip()
+boundary_style = shared_style(simplekml.Color.red, 2, simplekml.Color.changealphaint(50, simplekml.Color.red))
+# Same rows as boundaries_utm, so the stripped names come from the stats table
+for idx, name, geom in zip(boundaries_wgs84.index, stats_df['polygon_name'], boundaries_wgs84.geometry.values):
     poly_kml = boundary_folder.newpolygon(name=f"UIT Polygon {idx}: {name}")
     
-    if polygon.geometry.geom_type == 'Polygon':
-        coords = list(polygon.geometry.exterior.coords)
+    if geom.geom_type == 'Polygon':
+        coords = list(geom.exterior.coords)
         poly_kml.outerboundaryis = coords
     
-    poly_kml.style.linestyle.color = simplekml.Color.red
-    poly_kml.style.linestyle.width = 2
-    poly_kml.style.polystyle.color = simplekml.Color.changealphaint(50, simplekml.Color.red)
+    poly_kml.style = boundary_style
 
 # Add each layer to KML
 for layer_name, layer_data in loaded_layers.items():
@@ -238,16 +304,17 @@ for layer_name, layer_data in loaded_layers.items():
     if not wgs84_gdf.empty:
         layer_folder = kml.newfolder(name=f"{layer_name.title()} ({layer_data['description']})")
         
-        # Cap KML features for very large layers to avoid slow export
-        MAX_KML_FEATURES = 2000
-        if len(wgs84_gdf) > MAX_KML_FEATURES:
-            print(f"    Adding {layer_name}: {MAX_KML_FEATURES}/{len(wgs84_gdf)} features (capped)")
-            wgs84_gdf = wgs84_gdf.head(MAX_KML_FEATURES)
-        else:
-            print(f"    Adding {layer_name}: {len(wgs84_gdf)} features")
-
-        for idx, feature in wgs84_gdf.iterrows():
-            geom = feature.geometry
+        # All features go in: size is kept down by simplifying each geometry
+        # once per layer and skipping exact duplicate shapes, not by truncating
+        simple_geoms = wgs84_gdf.geometry.simplify(KML_SIMPLIFY_DEG, preserve_topology=True)
+        unique = ~simple_geoms.to_wkb().duplicated().values
+        if not unique.all():
+            wgs84_gdf, simple_geoms = wgs84_gdf[unique], simple_geoms[unique]
+        print(f"    Adding {layer_name}: {len(wgs84_gdf)} features")
+
+        # Walk plain attribute dicts rather than materializing a pandas row per feature
+        records = wgs84_gdf.drop(columns='geometry').to_dict('records')
+        for idx, feature, geom in zip(wgs84_gdf.index, records, simple_geoms.values):
             
             # Create feature name and description
             width = 2  # default line width for KML
@@ -281,14 +348,12 @@ for layer_name, layer_data in loaded_layers.items():
             if geom.geom_type == 'LineString':
                 line = layer_folder.newlinestring(name=name, description=desc)
                 line.coords = list(geom.coords)
-                line.style.linestyle.color = color
-                line.style.linestyle.width = width
+                line.style = shared_style(color, width)
                 
             elif geom.geom_type == 'Polygon':
                 poly = layer_folder.newpolygon(name=name, description=desc)
                 poly.outerboundaryis = list(geom.exterior.coords)
-                poly.style.linestyle.color = color
-                poly.style.polystyle.color = simplekml.Color.changealphaint(100, color)
+                poly.style = shared_style(color, fill_color=simplekml.Color.changealphaint(100, color))
 
 # Save KML
 kml_path = EXPORTS_DIR / 'drainage_master_plan_full.kml'
@@ -336,7 +401,9 @@ try:
         name='UIT Boundaries'
     ).add_to(m)
     
-    # Add each layer with appropriate styling
+    # Add each layer with appropriate styling (folium evaluates these once
+    # per feature and stores each distinct style only once in the HTML)
+    risk_fill = {'high': '#ff0000', 'medium': '#ff8800', 'low': '#ffff00'}
     layer_styles = {
         'streams': {
             'color': '#0066cc',
@@ -350,9 +417,7 @@ try:
             'fillOpacity': 0.7
         },
         'flood_risk': {
-            'fillColor': lambda f: {
-                'high': '#ff0000', 'medium': '#ff8800', 'low': '#ffff00'
-            }.get(f['properties'].get('risk_label', 'low'), '#888888'),
+            'fillColor': lambda f: risk_fill.get(f['properties'].get('risk_label', 'low'), '#888888'),
             'color': '#333333',
             'weight': 0.5,
             'fillOpacity': 0.4
@@ -366,6 +431,11 @@ try:
             if not wgs84_gdf.empty:
                 style = layer_styles[layer_name]
                 
+                # Same simplification as the KML keeps the inline GeoJSON small
+                map_gdf = wgs84_gdf.assign(
+                    geometry=wgs84_gdf.geometry.simplify(KML_SIMPLIFY_DEG, preserve_topology=True)
+                )
+                
                 # Create tooltip fields
                 tooltip_fields = []
                 if layer_name == 'streams':
@@ -376,7 +446,7 @@ try:
                     tooltip_fields = ['risk_label', 'area_hectares']
                 
                 folium.GeoJson(
-                    wgs84_gdf,
+                    map_gdf,
                     style_function=lambda x, style=style: {
                         k: (v(x) if callable(v) else v) 
                         for k, v in style.items()
@@ -405,7 +475,7 @@ print("LAYER PREPARATION COMPLETE")
 print("="*70)
 
 print(f"✓ Processed {len(loaded_layers)} layer types")
-print(f"✓ Generated statistics for {len(polygon_stats)} UIT polygons")
+print(f"✓ Generated statistics for {len(stats_df)} UIT polygons")
 print(f"✓ All outputs in UTM Zone 43N + WGS84 versions for web display")
 
 print(f"\nFinal exports in {EXPORTS_DIR}:")